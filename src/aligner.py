@@ -5,10 +5,12 @@ import srt
 from datetime import timedelta
 import sys
 import logging
+from timestamp_store import load_timestamps
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8")
+# delay: the worker processes of the spliter import this module too, the log is only opened when written
+file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8", delay=True)
 # formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 # file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
@@ -43,19 +45,18 @@ def aligner(fragments_file_path, timestamps_file_path, output_dir):
         exit(1)
     with open(fragments_file_path, 'r', encoding='utf-8') as f:
         fragments = json.load(f)
-    with open(timestamps_file_path, 'r', encoding='utf-8') as f:
-        timestamps = json.load(f)
+    timestamps = load_timestamps(timestamps_file_path)
 
     words1 = []
-    words2 = []
     for fragment in fragments:
         for sentence in fragment['en']:
             words1.extend(sentence.split())
     
-    for timestamp in timestamps:
-        words2.append(timestamp['word'])
+    words2 = timestamps.words
     check_clean_words(words1, words2)
   
+    starts = timestamps.starts.tolist()
+    ends = timestamps.ends.tolist()
     fragments_with_timestamps = []
     i = 0
     for fragment in fragments:
@@ -69,8 +70,8 @@ def aligner(fragments_file_path, timestamps_file_path, output_dir):
 
         for sentence in fragment['en']:
             clean_words = [eliminate_end_puncuation(word) for word in sentence.split()]
-            en_start = timestamps[i]['start']
-            en_end = timestamps[i+len(clean_words)-1]['end']
+            en_start = starts[i]
+            en_end = ends[i+len(clean_words)-1]
             fragment_with_timestamps['en_start'].append(en_start)
             fragment_with_timestamps['en_end'].append(en_end)
             i += len(clean_words)
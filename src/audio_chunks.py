@@ -0,0 +1,63 @@
+import numpy as np
+
+# The energy of the audio is measured on short frames, and a cut is placed in the quietest window of frames
+FRAME_SECONDS = 0.03
+SILENCE_WINDOW_SECONDS = 0.5
+
+def get_frame_energies(audio, frame_length):
+    num_frames = len(audio) // frame_length
+    frames = audio[:num_frames*frame_length].reshape(num_frames, frame_length)
+    # einsum sums the squares without a copy of the whole audio
+    return np.einsum('ij,ij->i', frames, frames, dtype=np.float64)
+
+def find_silence_cuts(audio, sample_rate, chunk_seconds, search_seconds):
+    # Returns the sample positions of the cuts, from 0 to len(audio). Every cut is placed in the quietest window
+    # within search_seconds of chunk_seconds after the previous cut, the last chunk takes the rest of the audio.
+    frame_length = int(sample_rate*FRAME_SECONDS)
+    chunk_frames = int(chunk_seconds/FRAME_SECONDS)
+    search_frames = min(int(search_seconds/FRAME_SECONDS), chunk_frames // 2)
+    energies = get_frame_energies(audio, frame_length)
+    num_frames = len(energies)
+    if chunk_frames <= 0 or num_frames <= chunk_frames + search_frames:
+        return [0, len(audio)]
+
+    # Mean energy of the window centered on every frame, a long pause is preferred to a short dip between two words
+    window = max(1, int(round(SILENCE_WINDOW_SECONDS/FRAME_SECONDS)))
+    energies = np.convolve(energies, np.ones(window)/window, mode='same')
+    cuts = [0]
+    while num_frames - cuts[-1] > chunk_frames + search_frames:
+        low = cuts[-1] + chunk_frames - search_frames
+        high = cuts[-1] + chunk_frames + search_frames
+        cuts.append(low + int(np.argmin(energies[low:high])))
+    return [cut*frame_length for cut in cuts] + [len(audio)]
+
+def get_chunks(num_samples, cuts, overlap_samples):
+    # (start, end, core_start, core_end) of every chunk. The chunk is transcribed from start to end,
+    # and only the words in its core, between two cuts, are kept
+    chunks = []
+    for i in range(len(cuts)-1):
+        start = max(0, cuts[i]-overlap_samples)
+        end = min(num_samples, cuts[i+1]+overlap_samples)
+        chunks.append((start, end, cuts[i], cuts[i+1]))
+    return chunks
+
+def offset_chunk_segments(segments, chunk, sample_rate, is_first, is_last, first_id):
+    # Moves the segments of a chunk to the time of the whole audio, and drops the words of the overlaps.
+    # A word belongs to the chunk whose core has its middle, so a word transcribed by both chunks at a seam is kept once.
+    start, _, core_start, core_end = chunk
+    offset = start/sample_rate
+    core_start = float('-inf') if is_first else core_start/sample_rate
+    core_end = float('inf') if is_last else core_end/sample_rate
+    kept_segments = []
+    for segment in segments:
+        words = []
+        for word in segment['words']:
+            word_start = round(word['start'] + offset, 2)
+            word_end = round(word['end'] + offset, 2)
+            if core_start <= (word_start + word_end)/2 < core_end:
+                words.append(dict(word, start=word_start, end=word_end))
+        if not words:
+            continue
+        kept_segments.append(dict(segment, id=first_id+len(kept_segments), seek=segment['seek'] + int(round(offset*100)),
+                                  start=words[0]['start'], end=words[-1]['end'], text=''.join([word['word'] for word in words]), words=words))
+    return kept_segments
@@ -0,0 +1,67 @@
+import os
+import json
+import logging
+import subprocess
+import numpy as np
+
+# The audio logs to the transcriber log
+logger = logging.getLogger("transcriber")
+
+# The rate of the whisper models
+SAMPLE_RATE = 16000
+PCM_FILE_NAME = 'audio_16k.f32'
+INFO_FILE_NAME = 'audio_16k.json'
+
+def decode_to_pcm(audio_path, pcm_path):
+    # Same samples as whisper.load_audio: ffmpeg decodes to 16 bit mono, which is scaled to float32.
+    # The samples are written block by block, the whole audio is never in memory.
+    cmd = ['ffmpeg', '-nostdin', '-threads', '0', '-loglevel', 'error', '-i', audio_path,
+           '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), '-']
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    num_samples = 0
+    remainder = b''
+    with open(pcm_path, 'wb') as f:
+        for block in iter(lambda: process.stdout.read(1 << 20), b''):
+            block = remainder + block
+            # A sample may be cut between two blocks
+            remainder = block[len(block) - len(block) % 2:]
+            samples = np.frombuffer(block[:len(block) - len(remainder)], np.int16).astype(np.float32) / 32768.0
+            f.write(samples.tobytes())
+            num_samples += len(samples)
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"Failed to load audio: {stderr.decode()}")
+    return num_samples
+
+def prepare_pcm(audio_path, output_dir, source_hash):
+    # Decodes the audio into output_dir once, a later run reuses the samples if the audio file has the same hash
+    pcm_path = os.path.join(output_dir, PCM_FILE_NAME)
+    info_path = os.path.join(output_dir, INFO_FILE_NAME)
+    info = {'source_hash': source_hash, 'sample_rate': SAMPLE_RATE}
+    if os.path.exists(info_path) and os.path.exists(pcm_path):
+        with open(info_path, 'r', encoding='utf-8') as f:
+            saved_info = json.load(f)
+        if {key: saved_info.get(key) for key in info} == info and os.path.getsize(pcm_path) == saved_info.get('num_samples', -1) * 4:
+            logger.info(f"Decoded audio {pcm_path} is reused")
+            return pcm_path
+
+    # The info is written last, an interrupted decoding is not reused
+    if os.path.exists(info_path):
+        os.remove(info_path)
+    tmp_path = pcm_path + '.tmp'
+    try:
+        info['num_samples'] = decode_to_pcm(audio_path, tmp_path)
+    except RuntimeError:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, pcm_path)
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    logger.info(f"Audio is decoded to {pcm_path}: {info['num_samples']/SAMPLE_RATE:.2f} seconds")
+    return pcm_path
+
+def open_pcm(pcm_path):
+    # Copy on write: the pages are shared with the file and the other processes, and the array stays writable for torch
+    if os.path.getsize(pcm_path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(pcm_path, dtype=np.float32, mode='c')
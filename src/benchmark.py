@@ -0,0 +1,483 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import subator_constants
+
+# Benchmarks of the Subator stages, run from the src directory: python benchmark.py <stage> --help
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values)*q))]
+
+def read_lines(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f.readlines()]
+
+def benchmark_translator(args):
+    from mock_llm_server import server_from_args
+    import translator
+    import llm_providers
+
+    server = server_from_args(args).start()
+    subator_constants.GPT_BASE_URL = f'{server.base_url}/v1'
+    subator_constants.QWEN_BASE_URL = f'{server.base_url}/api/v1'
+    # Every run must reach the server
+    subator_constants.TRANSLATION_CACHE_PATH = ''
+    subator_constants.TRANSLATION_MEMORY_PATH = ''
+    translator.stream_handler.setLevel(logging.CRITICAL)
+
+    # Time every request as seen by the translator
+    latencies = []
+    original_call = llm_providers.LLMProvider.call
+    def timed_call(self, index, messages):
+        start = time.perf_counter()
+        result = original_call(self, index, messages)
+        latencies.append(time.perf_counter() - start)
+        return result
+    llm_providers.LLMProvider.call = timed_call
+
+    batch_size = args.batch_size if args.batch_size is not None else subator_constants.TRANSLATE_BATCH_SIZE
+    print(f"{'file':<40} {'sentences':>9} {'seconds':>8} {'sent/s':>8} {'requests':>8} {'retries':>8} {'429':>5} {'bad':>5} {'flagged':>7} {'p50':>6} {'p95':>6} {'p99':>6}")
+    for sentences_file_path in args.sentences:
+        output_dir = tempfile.mkdtemp()
+        num_sentences = len(translator.get_sentences(sentences_file_path))
+        latencies.clear()
+        stats_before = dict(server.stats)
+        start = time.perf_counter()
+        translator.translator(sentences_file_path, output_dir, 'mock-api-key', args.user_prompt, args.llm, batch_size, False, (), args.engine)
+        elapsed = time.perf_counter() - start
+
+        sentences = translator.get_sentences(sentences_file_path)
+        sentences_translated = [sentence.strip() for sentence in translator.get_sentences(os.path.join(output_dir, 'sentences_translated.txt'))]
+        flagged = translator.get_flagged_indices(sentences, sentences_translated)
+        shutil.rmtree(output_dir)
+
+        num_requests = server.stats['requests'] - stats_before['requests']
+        first_attempts = -(-num_sentences // max(1, batch_size))
+        name = os.path.basename(os.path.dirname(os.path.abspath(sentences_file_path))) + '/' + os.path.basename(sentences_file_path)
+        print(f"{name[-40:]:<40} {num_sentences:>9} {elapsed:>8.2f} {num_sentences/elapsed:>8.2f} {num_requests:>8} {num_requests-first_attempts:>8} "
+              f"{server.stats['rate_limited']-stats_before['rate_limited']:>5} {server.stats['malformed']-stats_before['malformed']:>5} {len(flagged):>7} "
+              f"{percentile(latencies, 0.5):>6.2f} {percentile(latencies, 0.95):>6.2f} {percentile(latencies, 0.99):>6.2f}")
+    server.stop()
+
+def benchmark_memory(args):
+    from translation_memory import TranslationMemory
+
+    # The pairs of the given runs, padded with shuffled copies of their sentences up to --size pairs
+    pairs = []
+    for resources_dir in args.resources:
+        sentences = read_lines(os.path.join(resources_dir, 'sentences.txt'))
+        sentences_translated = read_lines(os.path.join(resources_dir, 'sentences_translated.txt'))
+        pairs.extend(zip(sentences, sentences_translated))
+    if not pairs:
+        print("No sentences found")
+        return
+    queries = [sentence for sentence, _ in pairs]
+    rng = random.Random(args.seed)
+    while len(pairs) < args.size:
+        sentence, sentence_translated = rng.choice(pairs)
+        words = sentence.split()
+        rng.shuffle(words)
+        pairs.append((' '.join(words), sentence_translated))
+
+    memory_dir = tempfile.mkdtemp()
+    memory_path = os.path.join(memory_dir, 'memory.sqlite')
+    memory = TranslationMemory(memory_path)
+    start = time.perf_counter()
+    with memory.lock:
+        for sentence, sentence_translated in pairs:
+            memory.index_pair(sentence, sentence_translated)
+        memory.save_index()
+    build_time = time.perf_counter() - start
+    memory.close()
+    # A later run only loads the saved index
+    start = time.perf_counter()
+    memory = TranslationMemory(memory_path)
+    open_time = time.perf_counter() - start
+
+    latencies = []
+    num_reused = 0
+    num_with_examples = 0
+    for sentence in queries:
+        start = time.perf_counter()
+        matches = memory.lookup(sentence)
+        latencies.append(time.perf_counter() - start)
+        if matches and matches[0][0] >= subator_constants.TRANSLATION_MEMORY_REUSE_SIMILARITY:
+            num_reused += 1
+        elif matches:
+            num_with_examples += 1
+    memory.close()
+    shutil.rmtree(memory_dir)
+
+    print(f"{'pairs':>8} {'ngrams':>8} {'build s':>8} {'open s':>8} {'lookups':>8} {'reused':>8} {'examples':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    print(f"{len(memory):>8} {len(memory.ngram_ids):>8} {build_time:>8.2f} {open_time:>8.2f} {len(queries):>8} {num_reused:>8} {num_with_examples:>8} "
+          f"{percentile(latencies, 0.5)*1000:>8.3f} {percentile(latencies, 0.95)*1000:>8.3f} {percentile(latencies, 0.99)*1000:>8.3f}")
+
+def split_en_fragment_by_enumeration(en_fragment, ratio):
+    # The former split_en_fragment_by_ratio, it enumerates every partition of at most 15 spans
+    import spliter
+    spans = en_fragment.split()
+    if len(spans) > 15:
+        spans = spliter.merge_by_num(spans, 15, len)
+    all_possible_fragments = spliter.get_all_possible_fragments(spans, len(ratio))
+    min_loss = float('inf')
+    best_fragments_index = 0
+    for i, fragments in enumerate(all_possible_fragments):
+        loss = spliter.cal_loss(fragments, ratio)
+        if loss < min_loss:
+            min_loss = loss
+            best_fragments_index = i
+    return all_possible_fragments[best_fragments_index]
+
+def benchmark_split_en(args):
+    import spliter
+    spliter.stream_handler.setLevel(logging.CRITICAL)
+
+    # Every run of consecutive fragments is a case: the English words of the run split by the ratio of its Chinese fragments
+    cases = []
+    for fragments_file_path in args.fragments:
+        with open(fragments_file_path, 'r', encoding='utf-8') as f:
+            fragments = json.load(f)
+        for num_fragments in range(2, args.max_fragments+1):
+            for start in range(len(fragments) - num_fragments + 1):
+                run = fragments[start:start+num_fragments]
+                en_fragment = ' '.join([en for fragment in run for en in fragment['en']])
+                if any([not fragment['ch'] for fragment in run]) or len(en_fragment.split()) < num_fragments:
+                    continue
+                cases.append((en_fragment, spliter.get_ratio([fragment['ch'] for fragment in run], spliter.ch_len)))
+    if not cases:
+        print("No cases found")
+        return
+
+    print(f"{'splitter':<12} {'cases':>6} {'seconds':>8} {'ms/case':>8} {'mean loss':>10} {'lower':>6} {'higher':>6}")
+    results = {}
+    for name, split in [('enumeration', split_en_fragment_by_enumeration), ('dp', spliter.split_en_fragment_by_ratio)]:
+        start = time.perf_counter()
+        results[name] = [spliter.cal_loss(split(en_fragment, ratio), ratio) for en_fragment, ratio in cases]
+        elapsed = time.perf_counter() - start
+        lower = len([1 for loss, other in zip(results[name], results['enumeration']) if loss < other - 1e-12])
+        higher = len([1 for loss, other in zip(results[name], results['enumeration']) if loss > other + 1e-12])
+        print(f"{name:<12} {len(cases):>6} {elapsed:>8.2f} {elapsed/len(cases)*1000:>8.3f} {sum(results[name])/len(cases):>10.4f} {lower:>6} {higher:>6}")
+    long_cases = [i for i, (en_fragment, _) in enumerate(cases) if len(en_fragment.split()) > 15]
+    if long_cases:
+        print(f"Cases over 15 words: {len(long_cases)}, mean loss enumeration {sum([results['enumeration'][i] for i in long_cases])/len(long_cases):.4f}, dp {sum([results['dp'][i] for i in long_cases])/len(long_cases):.4f}")
+
+def benchmark_spliter(args):
+    import spliter
+    spliter.stream_handler.setLevel(logging.CRITICAL)
+
+    num_workers_list = args.num_workers or [1, os.cpu_count()]
+    num_sentences = len(spliter.read_file(args.en_path))
+    print(f"{'workers':>7} {'sentences':>9} {'seconds':>8} {'sent/s':>8} {'speed-up':>8} {'identical':>9}")
+    serial_time = None
+    serial_output = None
+    for num_workers in num_workers_list:
+        output_dir = tempfile.mkdtemp()
+        start = time.perf_counter()
+        spliter.spliter(args.en_path, args.ch_path, output_dir, num_workers, False)
+        elapsed = time.perf_counter() - start
+        with open(os.path.join(output_dir, 'fragments.json'), 'rb') as f:
+            output = f.read()
+        shutil.rmtree(output_dir)
+        if serial_time is None:
+            serial_time = elapsed
+            serial_output = output
+        print(f"{num_workers:>7} {num_sentences:>9} {elapsed:>8.2f} {num_sentences/elapsed:>8.2f} {serial_time/elapsed:>8.2f} {str(output == serial_output):>9}")
+
+def benchmark_split_engines(args):
+    import spliter
+    spliter.stream_handler.setLevel(logging.CRITICAL)
+    MAX_FRAGMENT_LENGTH = subator_constants.MAX_CH_FRAGMENT_LENGTH
+
+    engines = args.engine or ['trf', 'md', 'sm', 'rule']
+    num_sentences = len(spliter.read_file(args.en_path))
+    print(f"{'engine':<6} {'sentences':>9} {'seconds':>8} {'sent/s':>8} {'fragments':>9} {'mean len':>8} {'p50':>4} {'p95':>4} {'max':>4} {'short':>6} {'over':>5}")
+    for engine in engines:
+        output_dir = tempfile.mkdtemp()
+        start = time.perf_counter()
+        try:
+            spliter.spliter(args.en_path, args.ch_path, output_dir, 1, False, engine)
+        except (OSError, SystemExit) as e:
+            print(f"{engine:<6} skipped: {e}")
+            shutil.rmtree(output_dir)
+            continue
+        elapsed = time.perf_counter() - start
+        with open(os.path.join(output_dir, 'fragments.json'), 'r', encoding='utf-8') as f:
+            fragments = json.load(f)
+        shutil.rmtree(output_dir)
+
+        # The chinese fragment lengths against MAX_CH_FRAGMENT_LENGTH, short is the share under 30% of the limit
+        lengths = [spliter.ch_len(fragment['ch']) for fragment in fragments]
+        short = len([length for length in lengths if length < MAX_FRAGMENT_LENGTH * 0.3]) / len(lengths)
+        over = len([length for length in lengths if length > MAX_FRAGMENT_LENGTH])
+        print(f"{engine:<6} {num_sentences:>9} {elapsed:>8.2f} {num_sentences/elapsed:>8.2f} {len(lengths):>9} {sum(lengths)/len(lengths):>8.1f} "
+              f"{percentile(lengths, 0.5):>4} {percentile(lengths, 0.95):>4} {max(lengths):>4} {short:>6.1%} {over:>5}")
+
+def ch_len_loop(str):
+    # The former ch_len of the spliter and the translator
+    length = 0
+    i = 0
+    while i < len(str):
+        if not str[i].isascii():
+            length += 1
+            i += 1
+        else:
+            length += 1
+            i += 1
+            while i < len(str) and str[i].isascii() and str[i] != ' ':
+                i += 1
+    return length
+
+def benchmark_text_metrics(args):
+    import re
+    import text_metrics
+
+    # The translated sentences and their punctuation fragments, measured --repeat times like in the spliter and the translator
+    texts = []
+    for sentences_file_path in args.sentences:
+        for sentence in read_lines(sentences_file_path):
+            texts.append(sentence)
+            texts.extend([fragment for fragment in re.split(r'(?<=[。，！？；])', sentence) if fragment])
+    if not texts:
+        print("No sentences found")
+        return
+    workload = texts * args.repeat
+
+    text_metrics.ch_len.cache_clear()
+    results = {}
+    print(f"{'ch_len':<12} {'calls':>8} {'seconds':>8} {'us/call':>8} {'speed-up':>8} {'same':>5}")
+    for name, func in [('loop', ch_len_loop), ('regex', text_metrics.count_ch_units), ('cached', text_metrics.ch_len)]:
+        start = time.perf_counter()
+        results[name] = [func(text) for text in workload]
+        elapsed = time.perf_counter() - start
+        if name == 'loop':
+            loop_time = elapsed
+        print(f"{name:<12} {len(workload):>8} {elapsed:>8.3f} {elapsed/len(workload)*1e6:>8.2f} {loop_time/elapsed:>8.2f} {str(results[name] == results['loop']):>5}")
+
+    # Every slice between two punctuation marks of a sentence, from the slice or from the prefix sums of the sentence
+    sentences = [text for text in texts if text in set(read_lines(args.sentences[0]))] or texts
+    slices = []
+    for sentence in sentences:
+        boundaries = [0] + [match.end() for match in re.finditer(r'[。，！？；]', sentence)] + [len(sentence)]
+        slices.extend([(sentence, a, b) for i, a in enumerate(boundaries) for b in boundaries[i+1:]])
+    start = time.perf_counter()
+    loop_lengths = [ch_len_loop(sentence[a:b]) for sentence, a, b in slices]
+    loop_time = elapsed = time.perf_counter() - start
+    print(f"{'slice loop':<12} {len(slices):>8} {elapsed:>8.3f} {elapsed/len(slices)*1e6:>8.2f} {1:>8.2f} {'True':>5}")
+    start = time.perf_counter()
+    prefix_lengths = [text_metrics.get_text_metrics(sentence).span_len(a, b) for sentence, a, b in slices]
+    elapsed = time.perf_counter() - start
+    print(f"{'slice prefix':<12} {len(slices):>8} {elapsed:>8.3f} {elapsed/len(slices)*1e6:>8.2f} {loop_time/elapsed:>8.2f} {str(prefix_lengths == loop_lengths):>5}")
+
+def preprocess_transcription_former(text):
+    # The former preprocess_transcription of the transcriber
+    text = text.split()
+    lines = []
+    line = ''
+    for word in text:
+        if word[-1] in ['.', '!', '?', ':']:
+            line += word
+            lines.append(line)
+            line = ''
+        else:
+            line += word + ' '
+    if line:
+        lines.append(line)
+    lines = [line.strip() for line in lines]
+    lines = [line for line in lines if line]
+    return lines
+
+def merge_short_lines_former(sentences):
+    # The former merge_short_lines of the transcriber, without its logs
+    sentences.reverse()
+    i = 0
+    while i+1 < len(sentences):
+        if len(sentences[i+1].split()) < 5:
+            if sentences[i+1][-1] in [',', '.', '!', '?', ':']:
+                sentences[i] = sentences[i+1] + ' ' + sentences[i]
+            else:
+                sentences[i] = sentences[i+1] + ', ' + sentences[i]
+            del sentences[i+1]
+        else:
+            i += 1
+    sentences.reverse()
+
+    MAX_LINE_LENGTH = subator_constants.MAX_EN_FRAGMENT_LENGTH
+    i = 0
+    while i+1 < len(sentences):
+        if len(sentences[i]) + len(sentences[i+1]) < int(MAX_LINE_LENGTH):
+            if sentences[i][-1] in [',', '.', '!', '?', ':']:
+                sentences[i] = sentences[i] + ' ' + sentences[i+1]
+            else:
+                sentences[i] = sentences[i] + '. '+ sentences[i+1]
+            del sentences[i+1]
+        else:
+            i += 1
+    return sentences
+
+def get_synthetic_words(num_words, seed):
+    # Whisper words with a final punctuation every 2 to 20 words, no line is long enough to load the punctuation model
+    rng = random.Random(seed)
+    vocabulary = ['the', 'model', 'we', 'trained', 'on', 'data', 'is', 'about', 'three', 'times', 'faster', 'and', 'it', 'works', '2.5', 'percent']
+    words = []
+    sentence_length = rng.randint(2, 20)
+    for i in range(num_words):
+        word = rng.choice(vocabulary)
+        sentence_length -= 1
+        if sentence_length == 0:
+            word += rng.choice(['.', '.', '?', '!', ':'])
+            sentence_length = rng.randint(2, 20)
+        elif rng.random() < 0.05:
+            word += ','
+        words.append(' ' + word)
+    return words
+
+def benchmark_segmentation(args):
+    import transcriber
+    # Only the segmentation is measured, not the writing of its logs
+    transcriber.logger.setLevel(logging.WARNING)
+
+    print(f"{'words':>8} {'former s':>9} {'us/word':>8} {'linear s':>9} {'us/word':>8} {'speed-up':>8} {'same':>5}")
+    for num_words in args.words or [10000, 50000, 100000, 200000, 500000]:
+        words = get_synthetic_words(num_words, args.seed)
+        start = time.perf_counter()
+        text = ' '.join(words)
+        sentences = transcriber.process_transcription(text)
+        elapsed = time.perf_counter() - start
+
+        if num_words > args.former_max_words:
+            print(f"{num_words:>8} {'-':>9} {'-':>8} {elapsed:>9.3f} {elapsed/num_words*1e6:>8.2f} {'-':>8} {'-':>5}")
+            continue
+        start = time.perf_counter()
+        former_text = ''
+        for word in words:
+            former_text += word + ' '
+        former_sentences = merge_short_lines_former(transcriber.segment_lines(preprocess_transcription_former(former_text)))
+        former_elapsed = time.perf_counter() - start
+        print(f"{num_words:>8} {former_elapsed:>9.3f} {former_elapsed/num_words*1e6:>8.2f} {elapsed:>9.3f} {elapsed/num_words*1e6:>8.2f} "
+              f"{former_elapsed/elapsed:>8.2f} {str(former_sentences == sentences):>5}")
+
+def get_peak_rss():
+    # Peak resident memory of this process in MB, None when it can not be read
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 / 1024
+    except (ImportError, AttributeError):
+        return None
+
+def run_transcribe_backend(backend_name, model_name, num_threads, pcm_path, seconds):
+    # Runs in a new process, the peak memory is the one of this backend only
+    import audio_pcm
+    import transcribe_backends
+    backend = transcribe_backends.get_backend(backend_name, model_name, num_threads)
+    audio = audio_pcm.open_pcm(pcm_path)
+    if seconds:
+        audio = audio[:int(seconds*transcribe_backends.SAMPLE_RATE)]
+    start = time.perf_counter()
+    backend.get_model()
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = backend.transcribe(audio)
+    transcribe_time = time.perf_counter() - start
+    num_words = sum([len(segment['words']) for segment in result['segments']])
+    return len(audio)/transcribe_backends.SAMPLE_RATE, load_time, transcribe_time, num_words, get_peak_rss()
+
+def benchmark_transcribe(args):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import audio_pcm
+    import transcribe_backends
+    from transcription_cache import hash_file
+
+    # Every backend transcribes the same decoded samples
+    pcm_dir = tempfile.mkdtemp()
+    pcm_path = audio_pcm.prepare_pcm(args.audio_path, pcm_dir, hash_file(args.audio_path))
+    backends = args.backend or list(transcribe_backends.BACKENDS)
+    print(f"{'backend':<15} {'threads':>7} {'audio s':>8} {'load s':>7} {'seconds':>8} {'RTF':>6} {'words':>6} {'peak MB':>8}")
+    for backend_name in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            try:
+                audio_time, load_time, transcribe_time, num_words, peak_rss = executor.submit(
+                    run_transcribe_backend, backend_name, args.model, args.num_threads, pcm_path, args.seconds).result()
+            except (ImportError, OSError, RuntimeError) as e:
+                print(f"{backend_name:<15} skipped: {e}")
+                continue
+        peak_rss = f"{peak_rss:>8.0f}" if peak_rss is not None else f"{'-':>8}"
+        print(f"{backend_name:<15} {args.num_threads or 'default':>7} {audio_time:>8.1f} {load_time:>7.1f} {transcribe_time:>8.1f} {transcribe_time/audio_time:>6.3f} {num_words:>6} {peak_rss}")
+    shutil.rmtree(pcm_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Subator stages")
+    subparsers = parser.add_subparsers(dest="stage", required=True)
+
+    from mock_llm_server import add_server_arguments
+    translator_parser = subparsers.add_parser("translator", help="Translator throughput against the mock LLM server")
+    translator_parser.add_argument("--sentences", help="Path to a sentences.txt file", action="append", required=True)
+    translator_parser.add_argument("--llm", help="Language model, gpt or qwen", default="gpt")
+    translator_parser.add_argument("--engine", help="Translate engine, async or thread", default=None)
+    translator_parser.add_argument("--batch_size", help="Number of sentences translated in one request", type=int, default=None)
+    translator_parser.add_argument("--user_prompt", help="User prompt", default='You are a news anchor')
+    add_server_arguments(translator_parser)
+    translator_parser.set_defaults(func=benchmark_translator)
+
+    memory_parser = subparsers.add_parser("memory", help="Lookup latency of the translation memory")
+    memory_parser.add_argument("--resources", help="Resources dir of a run with sentences.txt and sentences_translated.txt", action="append", required=True)
+    memory_parser.add_argument("--size", help="Number of pairs in the memory", type=int, default=200000)
+    memory_parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    memory_parser.set_defaults(func=benchmark_memory)
+
+    split_en_parser = subparsers.add_parser("split_en", help="Speed and loss of the English split by ratio, dynamic programming against enumeration")
+    split_en_parser.add_argument("--fragments", help="Path to a fragments.json file", action="append", required=True)
+    split_en_parser.add_argument("--max_fragments", help="Largest number of consecutive fragments in a case", type=int, default=4)
+    split_en_parser.set_defaults(func=benchmark_split_en)
+
+    spliter_parser = subparsers.add_parser("spliter", help="Spliter speed-up with worker processes, the model is loaded by every run")
+    spliter_parser.add_argument("--en_path", help="Path to the English sentences file", required=True)
+    spliter_parser.add_argument("--ch_path", help="Path to the Chinese sentences file", required=True)
+    spliter_parser.add_argument("--num_workers", help="Number of worker processes of a run, the first run is the baseline", type=int, action="append")
+    spliter_parser.set_defaults(func=benchmark_spliter)
+
+    split_engines_parser = subparsers.add_parser("split_engines", help="Speed and chinese fragment lengths of the split engines")
+    split_engines_parser.add_argument("--en_path", help="Path to the English sentences file", required=True)
+    split_engines_parser.add_argument("--ch_path", help="Path to the Chinese sentences file", required=True)
+    split_engines_parser.add_argument("--engine", help="Split engine: trf, md, sm or rule, all by default", action="append")
+    split_engines_parser.set_defaults(func=benchmark_split_engines)
+
+    text_metrics_parser = subparsers.add_parser("text_metrics", help="ch_len of the translated sentences, the former loop against text_metrics")
+    text_metrics_parser.add_argument("--sentences", help="Path to a sentences_translated.txt file", action="append", required=True)
+    text_metrics_parser.add_argument("--repeat", help="Number of times each text is measured", type=int, default=5)
+    text_metrics_parser.set_defaults(func=benchmark_text_metrics)
+
+    segmentation_parser = subparsers.add_parser("segmentation", help="Per-word cost of the sentence segmentation on synthetic transcripts, the former quadratic one against the linear one")
+    segmentation_parser.add_argument("--words", help="Number of words of a transcript", type=int, action="append")
+    segmentation_parser.add_argument("--former_max_words", help="Largest transcript given to the former segmentation", type=int, default=200000)
+    segmentation_parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    segmentation_parser.set_defaults(func=benchmark_segmentation)
+
+    import transcribe_backends
+    transcribe_parser = subparsers.add_parser("transcribe", help="Real-time factor and peak memory of the transcribe backends")
+    transcribe_parser.add_argument("--audio_path", help="Path to the audio file", required=True)
+    transcribe_parser.add_argument("--seconds", help="Only transcribe the first seconds of the audio, 0 for all", type=float, default=300)
+    transcribe_parser.add_argument("--backend", help="Transcribe backend, all by default", choices=sorted(transcribe_backends.BACKENDS), action="append")
+    transcribe_parser.add_argument("--model", help="Model name", default=subator_constants.TRANSCRIBE_MODEL)
+    transcribe_parser.add_argument("--num_threads", help="Threads of the model, 0 for the default of the backend", type=int, default=subator_constants.TRANSCRIBE_NUM_THREADS)
+    transcribe_parser.set_defaults(func=benchmark_transcribe)
+
+    args = parser.parse_args()
+    args.func(args)
+    sys.exit(0)
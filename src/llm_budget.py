@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+import subator_constants
+
+# The budget logs to the translator log
+logger = logging.getLogger("translator")
+
+WINDOW_SECONDS = 60
+STALE_LOCK_SECONDS = 10
+
+class BudgetExceeded(Exception):
+    pass
+
+def estimate_tokens(messages):
+    # English takes about 4 characters per token, chinese about 1 character per token
+    text = ''.join([message['content'] for message in messages])
+    non_ascii = len(text) - len(text.encode('ascii', 'ignore'))
+    prompt_tokens = (len(text) - non_ascii) / 4 + non_ascii + 4 * len(messages)
+    # Leave room for the response
+    return int(prompt_tokens * 1.3) + 1
+
+@contextmanager
+def file_lock(lock_path):
+    # os.O_EXCL works on every platform, a lock left by a crashed process is removed after STALE_LOCK_SECONDS
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+# Admits the requests against the requests-per-minute and tokens-per-minute budgets.
+# Each admitted request is an event [id, time, tokens] in a sliding window of one minute, the tokens are
+# estimated before the call and replaced by the real usage afterwards.
+# With a shared file the events of all the local processes are counted against the same budgets.
+class BudgetScheduler:
+    def __init__(self, rpm_limit=None, tpm_limit=None, max_tokens=None, shared_path=None):
+        if rpm_limit is None:
+            rpm_limit = subator_constants.TRANSLATE_RPM_LIMIT
+        if tpm_limit is None:
+            tpm_limit = subator_constants.TRANSLATE_TPM_LIMIT
+        if max_tokens is None:
+            max_tokens = subator_constants.TRANSLATE_MAX_TOKENS
+        if shared_path is None:
+            shared_path = subator_constants.TRANSLATE_BUDGET_FILE
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.max_tokens = max_tokens
+        self.shared_path = shared_path
+        self.lock = threading.Lock()
+        self.events = []
+        self.reservations = {}
+        self.tokens_used = 0
+        self.tokens_reserved = 0
+        self.exceeded = False
+
+    @contextmanager
+    def locked_events(self):
+        with self.lock:
+            if not self.shared_path:
+                yield self.events
+                return
+            with file_lock(self.shared_path + '.lock'):
+                events = []
+                if os.path.exists(self.shared_path):
+                    try:
+                        with open(self.shared_path, 'r', encoding='utf-8') as f:
+                            events = json.load(f)['events']
+                    except (ValueError, KeyError):
+                        logger.warning(f"Budget file {self.shared_path} is broken, starting a new one")
+                yield events
+                with open(self.shared_path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump({'events': events}, f)
+                os.replace(self.shared_path + '.tmp', self.shared_path)
+
+    def admit(self, tokens_estimate):
+        while True:
+            with self.locked_events() as events:
+                if self.exceeded or (self.max_tokens and self.tokens_used + self.tokens_reserved + tokens_estimate > self.max_tokens):
+                    if not self.exceeded:
+                        logger.warning(f"Token budget of the job is exhausted: {self.tokens_used} used, {self.max_tokens} allowed. Stop translating.")
+                    self.exceeded = True
+                    raise BudgetExceeded(f"token budget {self.max_tokens} exhausted")
+                now = time.time()
+                events[:] = [event for event in events if event[1] > now - WINDOW_SECONDS]
+                tokens_in_window = sum([event[2] for event in events])
+                rpm_ok = not self.rpm_limit or len(events) < self.rpm_limit
+                # A request larger than the whole budget is admitted when the window is empty
+                tpm_ok = not self.tpm_limit or tokens_in_window + tokens_estimate <= self.tpm_limit or len(events) == 0
+                if rpm_ok and tpm_ok:
+                    reservation = uuid.uuid4().hex
+                    events.append([reservation, now, tokens_estimate])
+                    self.reservations[reservation] = tokens_estimate
+                    self.tokens_reserved += tokens_estimate
+                    return reservation
+                wait = events[0][1] + WINDOW_SECONDS - now
+            time.sleep(min(max(wait, 0.05), 1))
+
+    def settle(self, reservation, tokens_used):
+        with self.locked_events() as events:
+            for event in events:
+                if event[0] == reservation:
+                    event[2] = tokens_used
+                    break
+            self.tokens_reserved -= self.reservations.pop(reservation)
+            self.tokens_used += tokens_used
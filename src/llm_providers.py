@@ -0,0 +1,367 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http import HTTPStatus
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI
+from zhipuai import ZhipuAI
+import subator_constants
+from llm_budget import BudgetExceeded, estimate_tokens
+
+# The providers log to the translator log
+logger = logging.getLogger("translator")
+
+PROVIDERS = {}
+provider_instances = {}
+# The router builds the providers it routes to while holding the lock
+provider_instances_lock = threading.RLock()
+
+class LLMAPIError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def register_provider(provider_class):
+    PROVIDERS[provider_class.name] = provider_class
+    return provider_class
+
+def get_provider_class(name):
+    return PROVIDERS.get(name)
+
+def get_provider(name, api_key=None):
+    # The clients are built once per process and shared by all the threads
+    provider_class = PROVIDERS.get(name)
+    if provider_class is None:
+        return None
+    if api_key is None:
+        api_key = getattr(subator_constants, provider_class.api_key_name, '')
+    with provider_instances_lock:
+        if (name, api_key) not in provider_instances:
+            provider_instances[(name, api_key)] = provider_class(api_key)
+        return provider_instances[(name, api_key)]
+
+def get_retry_after(e):
+    # Returns the seconds to wait if the error is caused by rate limiting or timeout, otherwise None
+    status_code = getattr(e, 'status_code', None)
+    if status_code == 429:
+        headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+        try:
+            return float(headers.get('retry-after', subator_constants.TRANSLATE_RATE_LIMIT_WAIT))
+        except ValueError:
+            return subator_constants.TRANSLATE_RATE_LIMIT_WAIT
+    if 'timeout' in type(e).__name__.lower():
+        return 0
+    return None
+
+class LLMProvider:
+    name = ''
+    display_name = ''
+    api_key_name = ''
+    model = ''
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.stats_lock = threading.Lock()
+        self.num_success = 0
+        self.num_failure = 0
+        # Latencies of the recent requests, used to decide when to hedge
+        self.latencies = deque(maxlen=1000)
+
+    def get_latency_percentile(self, q):
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies)-1, int(len(latencies)*q))]
+
+    def log_stats(self):
+        num_requests = self.num_success + self.num_failure
+        if num_requests == 0:
+            return
+        logger.info(f"{self.display_name}:\tRequests: {num_requests}, success rate: {self.num_success/num_requests:.2%}, latency p50: {self.get_latency_percentile(0.5):.2f} seconds, p95: {self.get_latency_percentile(0.95):.2f} seconds")
+
+    def complete(self, messages):
+        # Returns the content of the response and the number of tokens used, raises on error
+        raise NotImplementedError
+
+    def call(self, index, messages, budget=None, accept=None):
+        # Every request sent is admitted against the budget, raises BudgetExceeded when the token cap of the job is reached.
+        # accept is only used by the router, the reply of a single provider is checked by the caller
+        reservation = budget.admit(estimate_tokens(messages)) if budget is not None else None
+        logger.debug(f"\t\tSentence {index}:\tCalling {self.display_name} API")
+        content_translated = ''
+        token_used = 0
+        response_valid = True
+        retry_after = None
+        start = time.monotonic()
+        try:
+            content_translated, token_used = self.complete(messages)
+        except Exception as e:
+            logger.error(f'\t\tSentence {index}:\tError calling {self.display_name} API: {e}')
+            content_translated = f'调用{self.display_name} API出错。'
+            response_valid = False
+            retry_after = get_retry_after(e)
+        with self.stats_lock:
+            self.latencies.append(time.monotonic() - start)
+            if response_valid:
+                self.num_success += 1
+            else:
+                self.num_failure += 1
+        if reservation is not None:
+            budget.settle(reservation, token_used)
+
+        logger.debug(f"\t\tSentence {index}:\tResponse: {content_translated}")
+        return content_translated, token_used, response_valid, retry_after
+
+def get_http_limits():
+    return httpx.Limits(max_connections=subator_constants.TRANSLATE_MAX_CONCURRENCY, max_keepalive_connections=subator_constants.TRANSLATE_MAX_CONCURRENCY)
+
+@register_provider
+class GPTProvider(LLMProvider):
+    name = 'gpt'
+    display_name = 'GPT'
+    api_key_name = 'GPT_API_KEY'
+    model = subator_constants.GPT_MODEL
+
+    def __init__(self, api_key):
+        super().__init__(api_key)
+        # The translator retries by itself, the rate limits and the timeouts must reach it
+        self.client = OpenAI(base_url=subator_constants.GPT_BASE_URL, api_key=api_key, max_retries=0, timeout=subator_constants.TRANSLATE_REQUEST_TIMEOUT,
+                             http_client=httpx.Client(limits=get_http_limits(), timeout=subator_constants.TRANSLATE_REQUEST_TIMEOUT))
+
+    def complete(self, messages):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+        )
+        return response.choices[0].message.content, response.usage.total_tokens
+
+@register_provider
+class QwenProvider(LLMProvider):
+    name = 'qwen'
+    display_name = 'Qwen'
+    api_key_name = 'QWEN_API_KEY'
+    model = subator_constants.QWEN_MODEL
+
+    def __init__(self, api_key):
+        super().__init__(api_key)
+        # dashscope.Generation opens a new session for every call, use the HTTP API with one pooled session instead
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=subator_constants.TRANSLATE_MAX_CONCURRENCY)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'})
+        self.url = f'{subator_constants.QWEN_BASE_URL}/services/aigc/text-generation/generation'
+
+    def complete(self, messages):
+        response = self.session.post(self.url, json={
+            'model': self.model,
+            'input': {'messages': messages},
+            'parameters': {
+                # set the random seed, optional, default to 1234 if not set
+                'seed': random.randint(1, 10000),
+                'result_format': 'message',  # set the result to be "message" format.
+            },
+        }, timeout=subator_constants.TRANSLATE_REQUEST_TIMEOUT)
+        if response.status_code != HTTPStatus.OK:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            error = LLMAPIError('Request id: %s, Status code: %s, error code: %s, error message: %s' % (
+                body.get('request_id'), response.status_code,
+                body.get('code'), body.get('message')
+            ), response.status_code)
+            error.response = response
+            raise error
+        body = response.json()
+        return body['output']['choices'][0]['message']['content'], body['usage']['total_tokens']
+
+@register_provider
+class GLMProvider(LLMProvider):
+    name = 'glm'
+    display_name = 'GLM'
+    api_key_name = 'GLM_API_KEY'
+    model = subator_constants.GLM_MODEL
+
+    def __init__(self, api_key):
+        super().__init__(api_key)
+        # The translator retries by itself, the rate limits and the timeouts must reach it
+        self.client = ZhipuAI(api_key=api_key, max_retries=0, timeout=subator_constants.TRANSLATE_REQUEST_TIMEOUT,
+                              http_client=httpx.Client(limits=get_http_limits(), timeout=subator_constants.TRANSLATE_REQUEST_TIMEOUT))
+
+    def complete(self, messages):
+        response = self.client.chat.completions.create(
+            model=self.model,  # model name
+            messages=messages,  # messages
+        )
+        return response.choices[0].message.content, response.usage.total_tokens
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures. After cooldown seconds it is half open: a single probe
+    # request is let through, its failure opens it again for another cooldown and its success closes it.
+    def __init__(self, name, failure_threshold, cooldown):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def is_available(self):
+        # Closed, or half open with no probe in flight. Does not take the probe.
+        with self.lock:
+            return self.opened_at is None or (not self.probing and time.monotonic() - self.opened_at >= self.cooldown)
+
+    def allow(self):
+        # Called right before a request is sent. Returns (allowed, probe), probe is True for the probe of a half open breaker.
+        with self.lock:
+            if self.opened_at is None:
+                return True, False
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return False, False
+            self.probing = True
+            return True, True
+
+    def record(self, success, probe=False):
+        with self.lock:
+            if probe:
+                self.probing = False
+            if success:
+                if self.opened_at is not None:
+                    logger.info(f"Circuit breaker of {self.name} is closed")
+                self.consecutive_failures = 0
+                self.opened_at = None
+                return
+            self.consecutive_failures += 1
+            if probe and self.opened_at is not None:
+                logger.warning(f"Circuit breaker of {self.name} is open again, the probe failed")
+                self.opened_at = time.monotonic()
+            elif self.consecutive_failures >= self.failure_threshold and self.opened_at is None:
+                logger.warning(f"Circuit breaker of {self.name} is open after {self.consecutive_failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+# Routes every request across several providers. The first provider with a closed circuit breaker gets the request,
+# a request slower than the latency percentile of its provider gets a hedged duplicate on the next provider,
+# and a failed request fails over to the next provider. The first valid response passing accept is kept.
+# Every request sent, the duplicates included, is admitted against the budget.
+@register_provider
+class RouterProvider(LLMProvider):
+    name = 'auto'
+    display_name = 'Router'
+    api_key_name = ''
+
+    def __init__(self, api_key):
+        super().__init__(api_key)
+        self.providers = []
+        for name in subator_constants.TRANSLATE_ROUTER_PROVIDERS:
+            provider_class = PROVIDERS[name]
+            if not getattr(subator_constants, provider_class.api_key_name, ''):
+                logger.warning(f"No API key for {provider_class.display_name}, it is not used by the router")
+                continue
+            self.providers.append(get_provider(name))
+        if not self.providers:
+            raise ValueError("No provider can be used by the router")
+        self.model = '+'.join([provider.model for provider in self.providers])
+        self.breakers = {provider.name: CircuitBreaker(provider.display_name, subator_constants.TRANSLATE_BREAKER_FAILURES, subator_constants.TRANSLATE_BREAKER_COOLDOWN) for provider in self.providers}
+        # The requests that lose the race keep running in the background
+        self.executor = ThreadPoolExecutor(max_workers=subator_constants.TRANSLATE_MAX_CONCURRENCY*2)
+        self.num_hedged = 0
+        self.num_failover = 0
+
+    def get_candidates(self):
+        return [provider for provider in self.providers if self.breakers[provider.name].is_available()]
+
+    def get_fallback(self):
+        # Every breaker is open or probing, try the one that opened first
+        return min(self.providers, key=lambda provider: self.breakers[provider.name].opened_at or 0)
+
+    def get_hedge_delay(self, provider):
+        if len(provider.latencies) < subator_constants.TRANSLATE_HEDGE_MIN_SAMPLES:
+            return subator_constants.TRANSLATE_HEDGE_DELAY
+        return provider.get_latency_percentile(subator_constants.TRANSLATE_HEDGE_PERCENTILE)
+
+    def call_provider(self, provider, probe, index, messages, budget):
+        result = provider.call(index, messages, budget)
+        self.breakers[provider.name].record(result[2], probe)
+        return result
+
+    def call(self, index, messages, budget=None, accept=None):
+        candidates = self.get_candidates()
+        future_to_provider = {}
+        def launch():
+            # Another request may have taken the probe of a half open breaker since the candidates were chosen
+            while candidates:
+                provider = candidates.pop(0)
+                allowed, probe = self.breakers[provider.name].allow()
+                if allowed:
+                    break
+            else:
+                if future_to_provider:
+                    return None
+                provider, probe = self.get_fallback(), False
+            future = self.executor.submit(self.call_provider, provider, probe, index, messages, budget)
+            future_to_provider[future] = provider
+            return future
+
+        latest = launch()
+        launched_at = time.monotonic()
+        pending = {latest}
+        result = None
+        rejected = None
+        exceeded = None
+        while pending:
+            timeout = None
+            if candidates:
+                timeout = max(0, launched_at + self.get_hedge_delay(future_to_provider[latest]) - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than usual, send a duplicate to the next provider and keep waiting for both
+                with self.stats_lock:
+                    self.num_hedged += 1
+                logger.debug(f"\t\tSentence {index}:\t{future_to_provider[latest].display_name} is slow, hedging on {candidates[0].display_name}")
+            else:
+                for future in done:
+                    try:
+                        result = future.result()
+                    except BudgetExceeded as e:
+                        # No more duplicates, the requests already sent may still succeed
+                        exceeded = e
+                        candidates.clear()
+                        continue
+                    if result[2] and (accept is None or accept(result[0])):
+                        with self.stats_lock:
+                            self.num_success += 1
+                        return result
+                    # A bad reply is only kept if no other request gives a good one
+                    if result[2] and rejected is None:
+                        rejected = result
+                if pending or not candidates:
+                    continue
+                with self.stats_lock:
+                    self.num_failover += 1
+                logger.debug(f"\t\tSentence {index}:\t{future_to_provider[latest].display_name} failed or gave a bad reply, failing over to {candidates[0].display_name}")
+            future = launch()
+            if future is None:
+                continue
+            latest = future
+            launched_at = time.monotonic()
+            pending.add(latest)
+        if rejected is not None:
+            result = rejected
+        if result is None:
+            raise exceeded
+        with self.stats_lock:
+            self.num_failure += 1
+        return result
+
+    def log_stats(self):
+        for provider in self.providers:
+            provider.log_stats()
+        logger.info(f"Router:\tHedged requests: {self.num_hedged}, failovers: {self.num_failover}, failed requests: {self.num_failure}")
@@ -0,0 +1,206 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A local stand-in for the LLM providers, it speaks the OpenAI chat completions protocol on /v1/chat/completions
+# and the DashScope generation protocol on /api/v1/services/aigc/text-generation/generation.
+# The latency follows a lognormal distribution, a part of the requests are rate limited or get a malformed reply.
+
+OPENAI_PATH = '/v1/chat/completions'
+DASHSCOPE_PATH = '/api/v1/services/aigc/text-generation/generation'
+
+SENTENCE_PATTERN = re.compile(r'into (?:Simplified )?Chinese: (.*)\. Do not output', re.S)
+NUMBERED_PATTERN = re.compile(r'^(\d+)\. (.*)$', re.M)
+
+def load_replay(resources_dir):
+    # The sentences and the translations of a real run, one sentence per line
+    with open(os.path.join(resources_dir, 'sentences.txt'), 'r', encoding='utf-8') as f:
+        sentences = [sentence.strip() for sentence in f.readlines()]
+    with open(os.path.join(resources_dir, 'sentences_translated.txt'), 'r', encoding='utf-8') as f:
+        sentences_translated = [sentence.strip() for sentence in f.readlines()]
+    return dict(zip(sentences, sentences_translated))
+
+# The benchmark drives up to TRANSLATE_MAX_CONCURRENCY connections at once, the socketserver backlog of 5 would refuse some of them
+class MockHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+def estimate_tokens(text):
+    non_ascii = len(text) - len(text.encode('ascii', 'ignore'))
+    return int((len(text) - non_ascii) / 4 + non_ascii) + 1
+
+class MockLLMServer:
+    def __init__(self, host='127.0.0.1', port=0, latency_median=0.5, latency_sigma=0.5, rate_limit_rate=0.0, malformed_rate=0.0, retry_after=1, replay=None, seed=None):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.replay = replay or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'malformed': 0, 'replayed': 0}
+        self.httpd = MockHTTPServer((host, port), self.make_handler())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def draw(self):
+        # Decide the latency and the outcome of one request
+        with self.lock:
+            self.stats['requests'] += 1
+            latency = self.latency_median * self.random.lognormvariate(0, self.latency_sigma) if self.latency_median > 0 else 0
+            outcome = 'ok'
+            value = self.random.random()
+            if value < self.rate_limit_rate:
+                outcome = 'rate_limited'
+                self.stats['rate_limited'] += 1
+            elif value < self.rate_limit_rate + self.malformed_rate:
+                outcome = 'malformed'
+                self.stats['malformed'] += 1
+        return latency, outcome
+
+    def translate(self, sentence):
+        sentence = sentence.strip()
+        if sentence in self.replay:
+            with self.lock:
+                self.stats['replayed'] += 1
+            return self.replay[sentence]
+        # About two chinese characters per english word keeps the reply under CH_EN_RATIO_LIMIT
+        return ('这是模拟的译文' * len(sentence.split()))[:max(1, 2*len(sentence.split()))] + '。'
+
+    def reply(self, messages, outcome):
+        content = messages[-1]['content'] if messages else ''
+        numbered = NUMBERED_PATTERN.findall(content) if 'numbered English sentence fragments' in content else []
+        if numbered:
+            reply = '\n'.join([f'{number}. {self.translate(sentence)}' for number, sentence in numbered])
+        else:
+            match = SENTENCE_PATTERN.search(content)
+            reply = self.translate(match.group(1) if match else content)
+        if outcome == 'malformed':
+            # The usual ways the real providers go wrong: explanations, extra lines
+            reply = self.random.choice([
+                f'翻译：{reply}',
+                f'{reply}\n下文的意思是：这是上下文。',
+                '',
+            ])
+        return reply
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self.send_json(400, {'error': {'message': 'invalid json'}})
+                    return
+                if self.path == OPENAI_PATH:
+                    messages = request.get('messages', [])
+                elif self.path == DASHSCOPE_PATH:
+                    messages = request.get('input', {}).get('messages', [])
+                else:
+                    self.send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+                    return
+
+                latency, outcome = server.draw()
+                time.sleep(latency)
+                request_id = uuid.uuid4().hex
+                if outcome == 'rate_limited':
+                    headers = {'Retry-After': str(server.retry_after)}
+                    if self.path == OPENAI_PATH:
+                        self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}, headers)
+                    else:
+                        self.send_json(429, {'request_id': request_id, 'code': 'Throttling.RateQuota', 'message': 'Requests rate limit exceeded, please try again later.'}, headers)
+                    return
+
+                content = server.reply(messages, outcome)
+                input_tokens = sum([estimate_tokens(message.get('content', '')) for message in messages])
+                output_tokens = estimate_tokens(content)
+                if self.path == OPENAI_PATH:
+                    self.send_json(200, {
+                        'id': f'chatcmpl-{request_id}',
+                        'object': 'chat.completion',
+                        'created': int(time.time()),
+                        'model': request.get('model', ''),
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                        'usage': {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens},
+                    })
+                else:
+                    self.send_json(200, {
+                        'request_id': request_id,
+                        'output': {'choices': [{'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}]},
+                        'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens},
+                    })
+
+        return Handler
+
+def add_server_arguments(parser):
+    parser.add_argument("--latency_median", help="Median latency of the replies in seconds", type=float, default=0.5)
+    parser.add_argument("--latency_sigma", help="Sigma of the lognormal latency distribution", type=float, default=0.5)
+    parser.add_argument("--rate_limit_rate", help="Fraction of the requests answered with 429", type=float, default=0.0)
+    parser.add_argument("--malformed_rate", help="Fraction of the replies that are malformed", type=float, default=0.0)
+    parser.add_argument("--retry_after", help="Retry-After of the 429 replies in seconds", type=float, default=1)
+    parser.add_argument("--replay", help="Resources dir of a real run, its sentences_translated.txt is replayed", action="append", default=[])
+    parser.add_argument("--seed", help="Random seed", type=int, default=None)
+
+def server_from_args(args, port=0):
+    replay = {}
+    for resources_dir in args.replay:
+        replay.update(load_replay(resources_dir))
+    return MockLLMServer(port=port, latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+                         rate_limit_rate=args.rate_limit_rate, malformed_rate=args.malformed_rate,
+                         retry_after=args.retry_after, replay=replay, seed=args.seed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock LLM server speaking the OpenAI and DashScope protocols")
+    parser.add_argument("--port", help="Port to listen on", type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_args(args, args.port)
+    print(f"Mock LLM server listening on {server.base_url}")
+    print(f"    GPT_BASE_URL = \"{server.base_url}/v1\"")
+    print(f"    QWEN_BASE_URL = \"{server.base_url}/api/v1\"")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"Stats: {server.stats}")
+        sys.exit(0)
@@ -0,0 +1,124 @@
+import re
+
+# A rule based stand-in for the chinese spacy models in the spliter. It only gives the tokens what get_ch_spans reads:
+# the text, the position, the sentence boundaries and a dependency label that starts or ends a span.
+# Bump when the lexicon or the rules change, the spliter cache keys on it
+VERSION = 1
+
+# Words that start a span, labelled like the conjunctions of the spacy parse
+START_WORDS = [
+    '但是', '可是', '然而', '不过', '而且', '并且', '或者', '还是', '所以', '因此', '因为', '由于', '如果', '假如', '虽然', '尽管',
+    '然后', '接着', '于是', '同时', '以及', '例如', '比如', '只要', '除非', '即使', '无论', '不管', '而是', '否则', '那么',
+    '但', '而', '并', '或', '且',
+]
+# Words that end a span: particles, copulas and prepositions, labelled like the stop labels of the spacy parse
+STOP_WORDS = {
+    'aux:asp': ['了', '着', '过'],
+    'mark': ['的话', '的时候', '时候', '之后', '以后', '之前', '以前', '的', '地', '得'],
+    'cop': ['就是', '是'],
+    'case': ['关于', '对于', '通过', '根据', '按照', '为了', '在', '从', '对', '把', '被', '给', '向', '跟', '与', '和'],
+}
+END_PUNCTUATION = '。！？!?'
+PUNCTUATION = '。，！？；：、“”‘’《》（）,.!?;:()"\''
+# Longest run of other characters in one span
+MAX_RUN_LENGTH = 8
+
+LEXICON = {word: 'cc' for word in START_WORDS}
+for label, words in STOP_WORDS.items():
+    for word in words:
+        LEXICON[word] = label
+WORD_PATTERN = re.compile('|'.join(sorted([re.escape(word) for word in LEXICON], key=len, reverse=True)))
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9]+(?:[-.\'][A-Za-z0-9]+)*|\s+|.', re.S)
+
+class RuleToken:
+    def __init__(self, doc, i, text, idx, dep):
+        self.doc = doc
+        self.i = i
+        self.text = text
+        self.idx = idx
+        self.dep_ = dep
+        self.is_sent_start = False
+        self.is_sent_end = False
+
+class RuleSpan:
+    def __init__(self, doc, start, end):
+        self.doc = doc
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        return iter(self.doc.tokens[self.start:self.end])
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def text(self):
+        if self.start >= self.end:
+            return ''
+        last = self.doc.tokens[self.end-1]
+        return self.doc.text[self.doc.tokens[self.start].idx:last.idx + len(last.text)]
+
+class RuleDoc:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        position = 0
+        for match in WORD_PATTERN.finditer(text):
+            self.add_run(text, position, match.start())
+            self.add_token(match.group(), match.start(), LEXICON[match.group()])
+            position = match.end()
+        self.add_run(text, position, len(text))
+
+        # The end punctuation ends a sentence
+        if self.tokens:
+            self.tokens[0].is_sent_start = True
+            self.tokens[-1].is_sent_end = True
+        for token in self.tokens[:-1]:
+            if token.text in END_PUNCTUATION:
+                token.is_sent_end = True
+                self.tokens[token.i+1].is_sent_start = True
+
+    def add_token(self, text, idx, dep):
+        self.tokens.append(RuleToken(self, len(self.tokens), text, idx, dep))
+
+    def add_run(self, text, start, end):
+        # The characters between the words of the lexicon, a long run is cut every MAX_RUN_LENGTH tokens
+        run_length = 0
+        for match in TOKEN_PATTERN.finditer(text, start, end):
+            if match.group().isspace():
+                continue
+            if len(match.group()) == 1 and match.group() in PUNCTUATION:
+                self.add_token(match.group(), match.start(), 'punct')
+                run_length = 0
+                continue
+            run_length += 1
+            self.add_token(match.group(), match.start(), 'dep' if run_length == MAX_RUN_LENGTH else '')
+            if run_length == MAX_RUN_LENGTH:
+                run_length = 0
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, _ = key.indices(len(self.tokens))
+            return RuleSpan(self, start, end)
+        return self.tokens[key]
+
+# Has the part of the spacy Language interface used by the spliter
+class RuleParser:
+    pipe_names = []
+
+    def __call__(self, text):
+        return RuleDoc(text)
+
+    def pipe(self, texts, batch_size=None):
+        for text in texts:
+            yield RuleDoc(text)
+
+    def select_pipes(self, disable=()):
+        pass
@@ -1,15 +1,20 @@
 import re
 import os
+import heapq
 import argparse
-import spacy
 import subator_constants
 import logging
 import sys
 import json
+from concurrent.futures import ProcessPoolExecutor
+from spliter_cache import SpliterCache
+from rule_parser import RuleParser
+from text_metrics import ch_len, get_text_metrics
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8")
+# delay: the worker processes import this module too, the log is only opened when written
+file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8", delay=True)
 # formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 # file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
@@ -23,20 +28,6 @@ def read_file(file_path):
     sentences = [sentence.strip() for sentence in sentences]
     return sentences
 
-def ch_len(str):
-    length = 0
-    i = 0
-    while i < len(str):
-        if not str[i].isascii():
-            length += 1
-            i += 1
-        else:
-            length += 1
-            i += 1
-            while i < len(str) and str[i].isascii() and str[i] != ' ':
-                i += 1
-    return length
-
 def split_sentence_according_to_pattern(sentence, pattern):
     fragments = re.split(pattern, sentence)
     logger.debug(f"            Fragments after splitting by pattern: {fragments}")
@@ -63,25 +54,126 @@ def eliminate_punctuation(fragment):
     fragment = fragment.strip()
     return fragment
 
+def ch_len_overlap(left, right):
+    # ch_len(left + right) == ch_len(left) + ch_len(right) - ch_len_overlap(left, right),
+    # the ascii word at the end of left goes on with the ascii word at the start of right
+    if left[-1].isascii() and right[0].isascii() and right[0] != ' ':
+        return 1
+    return 0
+
+def len_overlap(left, right):
+    return 0
+
+def get_overlap_func(len_func):
+    if len_func is ch_len:
+        return ch_len_overlap
+    if len_func is len:
+        return len_overlap
+    return None
+
+# Doubly linked list of spans with their lengths. Merging a span with the next one updates the length in O(1)
+# from the two lengths and the characters at the boundary, other len_func are called on the merged span.
+class SpanMerger:
+    def __init__(self, spans, len_func, lengths=None):
+        self.len_func = len_func
+        self.overlap_func = get_overlap_func(len_func)
+        self.spans = list(spans)
+        self.lengths = list(lengths) if lengths is not None else [len_func(span) for span in self.spans]
+        self.prev = [i-1 for i in range(len(self.spans))]
+        self.next = [i+1 if i+1 < len(self.spans) else -1 for i in range(len(self.spans))]
+        self.versions = [0] * len(self.spans)
+        # Number of the original spans merged into each span
+        self.sizes = [1] * len(self.spans)
+        self.head = 0 if self.spans else -1
+        self.num_spans = len(self.spans)
+
+    def join_length(self, left, left_length, right, right_length):
+        # Only the characters at the boundary are looked at
+        if not left or not right:
+            return left_length + right_length
+        return left_length + right_length - self.overlap_func(left, right)
+
+    def merged_length(self, i, separator=''):
+        j = self.next[i]
+        if self.overlap_func is None:
+            return self.len_func(self.spans[i] + separator + self.spans[j])
+        left, length = self.spans[i], self.lengths[i]
+        if separator:
+            length = self.join_length(left, length, separator, self.len_func(separator))
+            left = separator
+        return self.join_length(left, length, self.spans[j], self.lengths[j])
+
+    def merge(self, i, separator=''):
+        # Merge span i with the next span, span i takes the place of both
+        j = self.next[i]
+        self.lengths[i] = self.merged_length(i, separator)
+        self.spans[i] = self.spans[i] + separator + self.spans[j]
+        self.next[i] = self.next[j]
+        if self.next[j] != -1:
+            self.prev[self.next[j]] = i
+        self.next[j] = -1
+        self.spans[j] = None
+        self.sizes[i] += self.sizes[j]
+        self.versions[i] += 1
+        self.versions[j] += 1
+        self.num_spans -= 1
+
+    def to_list(self):
+        spans = []
+        i = self.head
+        while i != -1:
+            spans.append(self.spans[i])
+            i = self.next[i]
+        return spans
+
+    def to_lengths(self):
+        lengths = []
+        i = self.head
+        while i != -1:
+            lengths.append(self.lengths[i])
+            i = self.next[i]
+        return lengths
+
+    def to_ranges(self):
+        # The range of the original spans of each span
+        ranges = []
+        i = self.head
+        while i != -1:
+            ranges.append((i, i + self.sizes[i]))
+            i = self.next[i]
+        return ranges
+
 def merge_by_num(fragments, num_fragments, len_func):
     logger.debug(f"        Merging fragments by number {num_fragments}: {fragments}")
+    merger = get_merger_by_num(fragments, num_fragments, len_func)
+    fragments[:] = merger.to_list()
+    logger.debug(f"        Fragments after merging: {fragments}")
+    return fragments
 
+def get_merger_by_num(fragments, num_fragments, len_func, lengths=None):
     if len(fragments) < num_fragments:
         logger.error(f"        Number of fragments is less than {num_fragments}")
         exit(1)
 
-    while len(fragments) > num_fragments:
-        min_length = float('inf')
-        min_index = -1
-        for i in range(len(fragments)-1):
-            if len_func(fragments[i]) + len_func(fragments[i+1]) < min_length:
-                min_length = len_func(fragments[i]) + len_func(fragments[i+1])
-                min_index = i
-        fragments[min_index] = fragments[min_index] + sep(fragments[min_index], fragments[min_index+1]) + fragments[min_index+1]
-        del fragments[min_index+1]
-
-    logger.debug(f"        Fragments after merging: {fragments}")
-    return fragments
+    # Merge the two consecutive fragments with the smallest total length first, the leftmost pair on ties.
+    # The heap holds every pair of neighbours, a pair is stale once one of its fragments has been merged.
+    merger = SpanMerger(fragments, len_func, lengths)
+    heap = []
+    def push(i):
+        j = merger.next[i]
+        if j != -1:
+            heapq.heappush(heap, (merger.lengths[i] + merger.lengths[j], i, j, merger.versions[i], merger.versions[j]))
+    for i in range(len(fragments)-1):
+        push(i)
+    while merger.num_spans > num_fragments:
+        _, i, j, version_i, version_j = heapq.heappop(heap)
+        if merger.versions[i] != version_i or merger.versions[j] != version_j:
+            continue
+        merger.merge(i, sep(merger.spans[i], merger.spans[j]))
+        if merger.prev[i] != -1:
+            push(merger.prev[i])
+        push(i)
+    return merger
 
 # i.e. Iteratively merge the two shortest consecutive fragments if the length of the merged fragment is less than 2/3 of the MAX_FRAGMENT_LENGTH
 # If exists a fragment that is shorter than 1/6, merge them with preceding fragment unless the length of the merged fragment is longer than the MAX_FRAGMENT_LENGTH
@@ -89,26 +181,25 @@ def merge_ch_fragments_by_length(fragments):
     MAX_FRAGMENT_LENGTH = subator_constants.MAX_CH_FRAGMENT_LENGTH
     logger.debug(f"        Merging fragments by length {MAX_FRAGMENT_LENGTH}: {fragments}")
     
-    i = 0
-    if max([ch_len(fragment) for fragment in fragments]) > MAX_FRAGMENT_LENGTH:
+    merger = SpanMerger(fragments, ch_len)
+    if max(merger.lengths) > MAX_FRAGMENT_LENGTH:
         logger.error(f'        Max fragment length is too long')
         exit(1)
 
-    i = 0
-    while i+1 < len(fragments):
-        if (ch_len(fragments[i]) < int(MAX_FRAGMENT_LENGTH * 0.3)) and ch_len(fragments[i] + fragments[i+1]) <= MAX_FRAGMENT_LENGTH:
-            fragments[i] = fragments[i] + fragments[i+1]
-            del fragments[i+1]
+    i = merger.head
+    while merger.next[i] != -1:
+        if merger.lengths[i] < int(MAX_FRAGMENT_LENGTH * 0.3) and merger.merged_length(i) <= MAX_FRAGMENT_LENGTH:
+            merger.merge(i)
         else:
-            i += 1
+            i = merger.next[i]
 
-    i = 0
-    while i+1 < len(fragments):
-        if ch_len(fragments[i]) + ch_len(fragments[i+1]) <= int(MAX_FRAGMENT_LENGTH * 0.8):
-            fragments[i] = fragments[i] + fragments[i+1]
-            del fragments[i+1]
+    i = merger.head
+    while merger.next[i] != -1:
+        if merger.lengths[i] + merger.lengths[merger.next[i]] <= int(MAX_FRAGMENT_LENGTH * 0.8):
+            merger.merge(i)
         else:
-            i += 1
+            i = merger.next[i]
+    fragments[:] = merger.to_list()
     
     logger.debug(f"        Fragments after merging: {fragments}")
     return fragments
@@ -140,70 +231,97 @@ def get_ratio(spans, len_func):
     len_sum = sum([len_func(span) for span in spans])
     return [len_func(span)/len_sum for span in spans]
 
-def get_ch_spans(fragment, nlp):
+def get_ch_spans(fragment):
+    # The fragment is (text, doc, start, end), its tokens are doc[start:end] of the parse of the whole sentence.
+    # Returns the spans in the same form.
     logger.debug('        Using spacy to split the fragment into spans')
     MAX_FRAGMENT_LENGTH = subator_constants.MAX_CH_FRAGMENT_LENGTH
-    if fragment == '':
+    text, doc, start, end = fragment
+    if text == '':
         logger.error("        Empty fragment")
         exit(1)
 
     stop_sets = ['nsubj', 'dobj', 'prep', 'aux:asp', 'case', 'cop',  'advcl', 'punct', 'acomp', 'mark', 'nsubjpass', 'agent', 'dep'] # 
     start_sets = ['cc']
 
-    doc = nlp(fragment)
-
-    for token in doc:
+    for token in doc[start:end]:
         logger.debug(f'        {token.text} -- {token.dep_}')
 
-    spans = []
-    span_start = 0
-    for token in doc:
-        if token.is_sent_end:
-            span = doc[span_start:token.i+1]
-            spans.append(span.text)
+    # The first and the last tokens of the fragment start and end a sentence, like in a parse of the fragment alone
+    ranges = []
+    span_start = start
+    for token in doc[start:end]:
+        if token.is_sent_end or token.i == end-1:
+            ranges.append((span_start, token.i+1))
             span_start = token.i+1
         elif token.dep_ in stop_sets:
-            if token.text == '-' or (token.i+1 < len(doc) and doc[token.i+1].text == '-'):
+            if token.text == '-' or (token.i+1 < end and doc[token.i+1].text == '-'):
                 continue
-            span = doc[span_start:token.i+1]
-            spans.append(span.text)
+            ranges.append((span_start, token.i+1))
             span_start = token.i+1
-        elif token.dep_ in start_sets or token.is_sent_start:
+        elif token.dep_ in start_sets or token.is_sent_start or token.i == start:
             if span_start != token.i:
-                span = doc[span_start:token.i]
-                spans.append(span.text)
+                ranges.append((span_start, token.i))
             span_start = token.i
     
-    assert span_start == len(doc)
+    assert span_start == end
 
-    if len(spans) == 1:
+    if len(ranges) == 1:
         logger.error(f'        Spacy failed to get the spans')
         exit(1)
+    spans = [(doc[span_start:span_end].text, doc, span_start, span_end) for span_start, span_end in ranges]
+    # The lengths of the spans from the character offsets of their tokens in the sentence
+    metrics = get_text_metrics(doc.text)
+    lengths = [metrics.span_len(doc[span_start].idx, doc[span_end-1].idx + len(doc[span_end-1].text)) for span_start, span_end in ranges]
     
     # do some merge, because the size of all_possible_fragments is exponential to the number of spans
     # ...
     if len(spans) > 15:
         logger.warning(f'        Too much spans {len(spans)}, merge to 15')
-        spans = merge_by_num(spans, 15, ch_len)
+        spans, lengths = merge_fragments_by_num(spans, 15, lengths)
     
     for i in range(len(spans)):
-        if ch_len(spans[i]) > MAX_FRAGMENT_LENGTH:
-            logger.error(f'        Span {i} is too long: {ch_len(spans[i])}')
+        if lengths[i] > MAX_FRAGMENT_LENGTH:
+            logger.error(f'        Span {i} is too long: {lengths[i]}')
             exit(1)
 
-    logger.debug(f'        Spans: {spans}')
+    logger.debug(f'        Spans: {[span[0] for span in spans]}')
     
     return spans     
 
-def split_ch_fragment_into_two_fragments(fragment, nlp):
-    if fragment == '':
+def merge_fragments_by_num(fragments, num_fragments, lengths=None):
+    # merge_by_num on the texts of the (text, doc, start, end) fragments, keeping the tokens of the merged fragments.
+    # Returns the merged fragments and their lengths
+    merger = get_merger_by_num([fragment[0] for fragment in fragments], num_fragments, ch_len, lengths)
+    merged = [(text, fragments[first][1], fragments[first][2], fragments[last-1][3]) for text, (first, last) in zip(merger.to_list(), merger.to_ranges())]
+    return merged, merger.to_lengths()
+
+def split_ch_fragment_into_two_fragments(fragment):
+    if fragment[0] == '':
         logger.error("        Empty fragment")
         exit(1)
-    logger.debug(f"        Splitting fragment: {fragment}")
-    spans = get_ch_spans(fragment, nlp)
-    fragments = merge_by_num(spans, 2, ch_len)
+    logger.debug(f"        Splitting fragment: {fragment[0]}")
+    spans = get_ch_spans(fragment)
+    fragments, _ = merge_fragments_by_num(spans, 2)
     return fragments  
    
+def get_fragment_tokens(doc, fragments):
+    # The token range of each fragment of the parsed text, a token belongs to the fragment of its first character
+    ranges = []
+    token_i = 0
+    char_end = 0
+    for fragment in fragments:
+        char_end += len(fragment)
+        start = token_i
+        while token_i < len(doc) and doc[token_i].idx < char_end:
+            token_i += 1
+        ranges.append((start, token_i))
+    return ranges
+
+def split_ch_sentence_by_punctuation(sentence):
+    punctuation_pattern = r'([。，！？；])'
+    return split_sentence_according_to_pattern(sentence, punctuation_pattern)
+
 def split_ch_sentence_by_length(sentence, nlp):
     MAX_FRAGMENT_LENGTH = subator_constants.MAX_CH_FRAGMENT_LENGTH
     if sentence == '':
@@ -212,29 +330,39 @@ def split_ch_sentence_by_length(sentence, nlp):
     logger.debug(f"        Sentence: {sentence}")
     logger.debug(f"        Splitting sentence by max length: {MAX_FRAGMENT_LENGTH}")
     
-    punctuation_pattern = r'([。，！？；])'
-
     if ch_len(sentence) <= MAX_FRAGMENT_LENGTH:
         logger.debug(f"        No need to split")
         logger.debug(f"        Result: {sentence}")
         return [sentence]
     
     # First split the sentence according to punctuation
-    fragments = split_sentence_according_to_pattern(sentence, punctuation_pattern)
+    fragments = split_ch_sentence_by_punctuation(sentence)
     logger.debug(f"        Fragments after splitting by punctuation: {fragments}")
 
     # If still not satisfied the MAX_FRAGMENT_LENGTH condition
     # Iteratively split the longest fragment into fragments that less than MAX_FRAGMENT_LENGTH.
     # If the iteration does not change the number of fragments, just throw an error
-    while max([ch_len(fragment) for fragment in fragments]) > MAX_FRAGMENT_LENGTH:
+    # The sentence is parsed once, the fragments are split on the tokens of that parse
+    if max([ch_len(fragment) for fragment in fragments]) > MAX_FRAGMENT_LENGTH:
+        doc = nlp(sentence)
+        fragments = [(fragment, doc, start, end) for fragment, (start, end) in zip(fragments, get_fragment_tokens(doc, fragments))]
+    else:
+        fragments = [(fragment, None, 0, 0) for fragment in fragments]
+    while max([ch_len(fragment[0]) for fragment in fragments]) > MAX_FRAGMENT_LENGTH:
         new_fragments = []
         for fragment in fragments:
-            if ch_len(fragment) > MAX_FRAGMENT_LENGTH:
-                new_fragments.extend(split_ch_fragment_into_two_fragments(fragment, nlp))
+            if ch_len(fragment[0]) > MAX_FRAGMENT_LENGTH:
+                if fragment[2] == fragment[3]:
+                    # The tokens do not line up with the punctuation, parse the fragment alone
+                    logger.warning(f"        No tokens for the fragment {fragment[0]}, parsing it alone")
+                    fragment_doc = nlp(fragment[0])
+                    fragment = (fragment[0], fragment_doc, 0, len(fragment_doc))
+                new_fragments.extend(split_ch_fragment_into_two_fragments(fragment))
             else:
                 new_fragments.append(fragment)
         fragments = new_fragments
-        logger.debug(f"        Fragments after iteration: {fragments}")
+        logger.debug(f"        Fragments after iteration: {[fragment[0] for fragment in fragments]}")
+    fragments = [fragment[0] for fragment in fragments]
 
     # No fragments longer than MAX_FRAGMENT_LENGTH should exist
     # Try to merge the fragments to satisfy the preferred condition
@@ -248,21 +376,38 @@ def split_ch_sentence_by_length(sentence, nlp):
 def split_en_fragment_by_ratio(en_fragment, ratio):
     logger.debug(f"        Splitting sentence by ratio: {ratio}")
     spans = en_fragment.split()
-    if len(spans) > 15:
-        logger.warning(f'        Too much spans {len(spans)}, merge to 15')
-        spans = merge_by_num(spans, 15, len)
-    all_possible_fragments = get_all_possible_fragments(spans, len(ratio))
-
-    min_loss = float('inf')
-    best_fragments_index = 0
-    for i, fragments in enumerate(all_possible_fragments):
-        loss = cal_loss(fragments, ratio)
-        if loss < min_loss:
-            min_loss = loss
-            best_fragments_index = i
-    logger.debug(f"        Best fragments: {all_possible_fragments[best_fragments_index]}")
+    num_fragments = len(ratio)
+    if len(spans) < num_fragments:
+        logger.error(f"        Number of words {len(spans)} is less than {num_fragments}")
+        exit(1)
+
+    # Minimise cal_loss by dynamic programming over the word boundaries, O(n^2 * k).
+    # The length of a fragment is prefix[b] - prefix[a] - 1, the length of all the fragments only depends on their number.
+    ratio_sum = sum(ratio)
+    prefix = [0]
+    for span in spans:
+        prefix.append(prefix[-1] + len(span) + 1)
+    len_fragment = prefix[-1] - num_fragments
+
+    # best[b] is the (loss, cuts) of the best split of spans[:b] into j fragments, the losses are summed
+    # in the same order as cal_loss, ties are broken towards the earliest cuts like the enumeration did
+    best = {0: (0, ())}
+    for j in range(num_fragments):
+        new_best = {}
+        for b in range(j+1, len(spans) - (num_fragments-1-j) + 1):
+            for a, (loss, cuts) in best.items():
+                if a >= b:
+                    continue
+                loss = loss + abs(ratio[j]/ratio_sum - (prefix[b] - prefix[a] - 1)/len_fragment)
+                if b not in new_best or loss < new_best[b][0] or (loss == new_best[b][0] and cuts + (b,) < new_best[b][1]):
+                    new_best[b] = (loss, cuts + (b,))
+        best = new_best
+
+    min_loss, cuts = best[len(spans)]
+    fragments = [' '.join(spans[a:b]) for a, b in zip((0,) + cuts[:-1], cuts)]
+    logger.debug(f"        Best fragments: {fragments}")
     logger.debug(f"        Loss: {min_loss}")
-    return all_possible_fragments[best_fragments_index]
+    return fragments
 
 def split_en_fragment_by_length(en_fragment):
     MAX_FRAGMENT_LENGTH = subator_constants.MAX_EN_FRAGMENT_LENGTH
@@ -326,23 +471,73 @@ def check_clean_words(words1, words2):
             exit(1)
     logger.info('Cheking clean words passed: All words are equal')
 
-def spliter(en_path, ch_path, output_dir):
-    # Read the English and Chinese sentences
-    en_sentences = read_file(en_path)
-    ch_sentences = read_file(ch_path)
-    if len(en_sentences) != len(ch_sentences):
-        logger.error(f"Number of English sentences ({len(en_sentences)}) is not equal to the number of Chinese sentences ({len(ch_sentences)})")
+def needs_parse(ch_sentence):
+    # split_ch_sentence_by_length parses the sentences still too long after splitting by punctuation
+    MAX_FRAGMENT_LENGTH = subator_constants.MAX_CH_FRAGMENT_LENGTH
+    if ch_len(ch_sentence) <= MAX_FRAGMENT_LENGTH:
+        return False
+    return max([ch_len(fragment) for fragment in split_ch_sentence_by_punctuation(ch_sentence)]) > MAX_FRAGMENT_LENGTH
+
+# Stands in for nlp in the split functions. The sentences known in advance are parsed in batches by nlp.pipe,
+# any other text is parsed on its own. nlp is only loaded by load_nlp when a text has to be parsed.
+class ParsedDocs:
+    def __init__(self, load_nlp, texts, batch_size=None):
+        if batch_size is None:
+            batch_size = subator_constants.SPACY_BATCH_SIZE
+        self.load_nlp = load_nlp
+        self.nlp = None
+        texts = list(dict.fromkeys(texts))
+        self.docs = dict(zip(texts, self.get_nlp().pipe(texts, batch_size=batch_size))) if texts else {}
+        self.num_parsed_alone = 0
+
+    def get_nlp(self):
+        if self.nlp is None:
+            self.nlp = self.load_nlp()
+        return self.nlp
+
+    def __call__(self, text):
+        doc = self.docs.get(text)
+        if doc is None:
+            self.num_parsed_alone += 1
+            doc = self.get_nlp()(text)
+        return doc
+
+def get_engine_model(engine):
+    # The spacy model of the split engine, None for the rule engine
+    if engine == 'rule':
+        return None
+    if engine not in subator_constants.SPACY_CH_MODELS:
+        logger.error(f"Invalid split engine: {engine}")
         exit(1)
-    num_sentences = len(en_sentences)
-
-    # Load the spacy model
-    # en_nlp = spacy.load(f"{subator_constants.SPACY_EN_MODEL}")
-    ch_nlp = spacy.load(f"{subator_constants.SPACY_CH_MODEL}")
-
-    # Split the sentences into fragments using spacy, one chinese fragment may correspond to multiple english fragments
+    return subator_constants.SPACY_CH_MODELS[engine]
+
+def load_ch_nlp(engine):
+    # Every engine gives the docs read by get_ch_spans
+    model = get_engine_model(engine)
+    if model is None:
+        logger.info("Using the rule parser")
+        return RuleParser()
+    # Imported here, a run with every sentence in the cache does not need spacy
+    import spacy
+    ch_nlp = spacy.load(model)
+    disabled = [name for name in ch_nlp.pipe_names if name not in subator_constants.SPACY_CH_PIPES]
+    ch_nlp.select_pipes(disable=disabled)
+    logger.info(f"Loaded {model}, pipes: {ch_nlp.pipe_names}, disabled: {disabled}")
+    return ch_nlp
+
+def split_sentences(en_sentences, ch_sentences, load_nlp, indices, num_sentences, summary_level=logging.INFO):
+    # Returns the fragments of each sentence and the numbers of the texts parsed in batches and alone,
+    # indices are the numbers of the sentences in the file. The workers log their parse summaries at debug level,
+    # the main process logs the one of the whole run.
+    # First pass: parse all the long chinese sentences together, each sentence is parsed once
+    sentences_to_parse = [ch_sentence for ch_sentence in ch_sentences if needs_parse(ch_sentence)]
+    logger.log(summary_level, f"Parsing {len(sentences_to_parse)} sentences with batch size {subator_constants.SPACY_BATCH_SIZE}")
+    ch_nlp = ParsedDocs(load_nlp, sentences_to_parse)
+
+    # Second pass: split the sentences into fragments using the parsed sentences, one chinese fragment may correspond to multiple english fragments
     fragments = []
-    for i in range(num_sentences):
-        logger.info(f"Splitting sentence {i+1}/{num_sentences}")
+    for i in range(len(en_sentences)):
+        logger.info(f"Splitting sentence {indices[i]+1}/{num_sentences}")
         ch_sentence = ch_sentences[i]
         en_sentence = en_sentences[i]
         logger.info(f"    {en_sentence}")
@@ -353,7 +548,120 @@ def spliter(en_path, ch_path, output_dir):
             logger.info(f"    {fragment['ch']}")
             logger.info(f"    {fragment['en']}")
             logger.info('')
-        fragments.extend(splited_sentence)
+        fragments.append(splited_sentence)
+    logger.log(summary_level, f"Sentences parsed in batches: {len(ch_nlp.docs)}, texts parsed one by one: {ch_nlp.num_parsed_alone}")
+    return fragments, (len(ch_nlp.docs), ch_nlp.num_parsed_alone)
+
+# The workers keep their log records and send them back with the fragments, the main process writes them in order
+class BufferHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+worker_engine = None
+worker_nlp = None
+worker_log = None
+
+def init_worker(engine):
+    global worker_engine, worker_log
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    worker_log = BufferHandler()
+    logger.addHandler(worker_log)
+    worker_engine = engine
+
+def load_worker_nlp():
+    # Loaded by the first chunk that has a text to parse, and kept for the next chunks
+    global worker_nlp
+    if worker_nlp is None:
+        num_records = len(worker_log.records)
+        worker_nlp = load_ch_nlp(worker_engine)
+        # Every worker loads the model, the loading is not part of the log of the sentences
+        del worker_log.records[num_records:]
+    return worker_nlp
+
+def split_chunk(en_sentences, ch_sentences, indices, num_sentences):
+    worker_log.records.clear()
+    try:
+        fragments, num_parsed = split_sentences(en_sentences, ch_sentences, load_worker_nlp, indices, num_sentences, logging.DEBUG)
+    except SystemExit:
+        return None, None, worker_log.records
+    return fragments, num_parsed, worker_log.records
+
+def split_sentences_parallel(en_sentences, ch_sentences, indices, num_sentences, num_workers, engine):
+    CHUNK_SIZE = subator_constants.SPLITER_CHUNK_SIZE
+    starts = list(range(0, len(en_sentences), CHUNK_SIZE))
+    logger.debug(f"Splitting {len(en_sentences)} sentences in {len(starts)} chunks with {num_workers} workers")
+    # The log is the same as with one process, the parse summaries of the chunks are added up
+    logger.info(f"Parsing {len([ch_sentence for ch_sentence in ch_sentences if needs_parse(ch_sentence)])} sentences with batch size {subator_constants.SPACY_BATCH_SIZE}")
+    fragments = []
+    num_batched = 0
+    num_parsed_alone = 0
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=(engine,)) as executor:
+        # map returns the chunks in order
+        for chunk_fragments, num_parsed, records in executor.map(split_chunk,
+                                                      [en_sentences[start:start+CHUNK_SIZE] for start in starts],
+                                                      [ch_sentences[start:start+CHUNK_SIZE] for start in starts],
+                                                      [indices[start:start+CHUNK_SIZE] for start in starts],
+                                                      [num_sentences]*len(starts)):
+            for level, message in records:
+                logger.log(level, message)
+            if chunk_fragments is None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                exit(1)
+            fragments.extend(chunk_fragments)
+            num_batched += num_parsed[0]
+            num_parsed_alone += num_parsed[1]
+    logger.info(f"Sentences parsed in batches: {num_batched}, texts parsed one by one: {num_parsed_alone}")
+    return fragments
+
+def spliter(en_path, ch_path, output_dir, num_workers=None, use_cache=True, engine=None):
+    if num_workers is None:
+        num_workers = subator_constants.SPLITER_NUM_WORKERS
+    if engine is None:
+        engine = subator_constants.SPLITER_ENGINE
+    get_engine_model(engine)
+    if num_workers <= 0:
+        num_workers = os.cpu_count()
+
+    # Read the English and Chinese sentences
+    en_sentences = read_file(en_path)
+    ch_sentences = read_file(ch_path)
+    if len(en_sentences) != len(ch_sentences):
+        logger.error(f"Number of English sentences ({len(en_sentences)}) is not equal to the number of Chinese sentences ({len(ch_sentences)})")
+        exit(1)
+    num_sentences = len(en_sentences)
+
+    # Only the sentence pairs not in the cache are split, spacy is not loaded if none of them needs a parse
+    cache = None
+    sentence_fragments = [None] * num_sentences
+    if use_cache and subator_constants.SPLITER_CACHE_PATH:
+        cache = SpliterCache(subator_constants.SPLITER_CACHE_PATH, engine)
+        cache_keys = [cache.make_key(en_sentences[i], ch_sentences[i]) for i in range(num_sentences)]
+        sentence_fragments = cache.get_many(cache_keys)
+        logger.info(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+    indices = [i for i in range(num_sentences) if sentence_fragments[i] is None]
+    en_missed = [en_sentences[i] for i in indices]
+    ch_missed = [ch_sentences[i] for i in indices]
+
+    if not indices:
+        split_fragments = []
+    elif num_workers > 1 and len(indices) > subator_constants.SPLITER_CHUNK_SIZE:
+        # Every worker loads its own spacy model
+        split_fragments = split_sentences_parallel(en_missed, ch_missed, indices, num_sentences, num_workers, engine)
+    else:
+        # The spacy model is only loaded if a missed sentence has to be parsed
+        # en_nlp = spacy.load(f"{subator_constants.SPACY_EN_MODEL}")
+        split_fragments, _ = split_sentences(en_missed, ch_missed, lambda: load_ch_nlp(engine), indices, num_sentences)
+    for i, splited_sentence in zip(indices, split_fragments):
+        sentence_fragments[i] = splited_sentence
+    if cache is not None:
+        cache.put_many([(cache_keys[i], sentence_fragments[i]) for i in indices])
+        cache.close()
+    fragments = [fragment for splited_sentence in sentence_fragments for fragment in splited_sentence]
 
     words1 = []
     words2 = []
@@ -379,7 +687,10 @@ if __name__ == "__main__":
     parser.add_argument("--en_path", help="Path to the English sentences file", required=True)
     parser.add_argument("--ch_path", help="Path to the Chinese sentences file", required=True)
     parser.add_argument("--output_dir", help="Path to the output directory", required=True)
+    parser.add_argument("--num_workers", help="Number of worker processes, 0 for one per CPU", type=int, default=None)
+    parser.add_argument("--no_cache", help="Do not use the spliter cache", action="store_true")
+    parser.add_argument("--engine", help="Split engine: trf, md, sm or rule", default=None)
     args = parser.parse_args()
     
     # Call the slicer function
-    spliter(args.en_path, args.ch_path, args.output_dir)
\ No newline at end of file
+    spliter(args.en_path, args.ch_path, args.output_dir, args.num_workers, not args.no_cache, args.engine)
\ No newline at end of file
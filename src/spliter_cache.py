@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import importlib.metadata
+import subator_constants
+import rule_parser
+
+# Bump when a change of the split logic makes the cached fragments out of date
+SPLITER_VERSION = 1
+
+def get_model_version(model_name):
+    # The spacy models are installed as packages, their version is read without importing spacy
+    try:
+        return importlib.metadata.version(model_name)
+    except importlib.metadata.PackageNotFoundError:
+        return ''
+
+# The fragments of every sentence pair are stored in a sqlite file shared by all the jobs.
+# The key is the hash of everything that can change the fragments of the pair.
+class SpliterCache:
+    def __init__(self, cache_path, engine, max_entries=None, max_age_days=None):
+        if max_entries is None:
+            max_entries = subator_constants.SPLITER_CACHE_MAX_ENTRIES
+        if max_age_days is None:
+            max_age_days = subator_constants.SPLITER_CACHE_MAX_AGE_DAYS
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        if engine == 'rule':
+            self.model = 'rule'
+            self.model_version = rule_parser.VERSION
+        else:
+            self.model = subator_constants.SPACY_CH_MODELS[engine]
+            self.model_version = get_model_version(self.model)
+        # Several jobs may use the same file, wait for the other writers instead of failing
+        self.conn = sqlite3.connect(cache_path, timeout=30)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS fragments (key TEXT PRIMARY KEY, fragments TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)')
+        self.conn.commit()
+        self.evict()
+
+    def make_key(self, en_sentence, ch_sentence):
+        content = json.dumps([en_sentence, ch_sentence, subator_constants.MAX_EN_FRAGMENT_LENGTH, subator_constants.MAX_CH_FRAGMENT_LENGTH,
+                              self.model, self.model_version, SPLITER_VERSION], ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        # Returns the fragments of each key, None for the keys not in the cache
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start+500]
+            rows = self.conn.execute(f'SELECT key, fragments FROM fragments WHERE key IN ({",".join(["?"]*len(chunk))})', chunk).fetchall()
+            found.update(rows)
+        now = time.time()
+        self.conn.executemany('UPDATE fragments SET last_used = ? WHERE key = ?', [(now, key) for key in found])
+        self.conn.commit()
+        results = [json.loads(found[key]) if key in found else None for key in keys]
+        self.hits += len([result for result in results if result is not None])
+        self.misses += len([result for result in results if result is None])
+        return results
+
+    def put_many(self, items):
+        now = time.time()
+        self.conn.executemany('INSERT OR REPLACE INTO fragments (key, fragments, created, last_used) VALUES (?, ?, ?, ?)',
+                              [(key, json.dumps(fragments, ensure_ascii=False), now, now) for key, fragments in items])
+        self.conn.commit()
+
+    def evict(self):
+        # Drop the entries not used for max_age_days, then the least recently used ones above max_entries
+        if self.max_age_days:
+            self.conn.execute('DELETE FROM fragments WHERE last_used < ?', (time.time() - self.max_age_days*24*3600,))
+        if self.max_entries:
+            self.conn.execute('DELETE FROM fragments WHERE key IN (SELECT key FROM fragments ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        self.evict()
+        self.conn.close()
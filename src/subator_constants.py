@@ -13,22 +13,105 @@ AUDIO_ABR = "160kbps"
 SUPER_RESOLUTION_EXE = ".\\realesrgan-ncnn-vulkan-20220424-windows\\realesrgan-ncnn-vulkan.exe"
 
 # transcriber
+# transcribe backend: whisper for openai-whisper (fp32 PyTorch), faster_whisper for CTranslate2
+TRANSCRIBE_BACKEND = "whisper"
 TRANSCRIBE_MODEL = "medium.en"
+# threads of the model, 0 for the default of the backend, or a share of the CPUs with several workers
+TRANSCRIBE_NUM_THREADS = 0
+# weights of the faster_whisper backend: int8, int8_float32, float32
+TRANSCRIBE_COMPUTE_TYPE = "int8"
+# number of worker processes transcribing the chunks of the audio, each loads its own whisper model, 0 for one per CPU.
+# 1 transcribes the whole audio at once in the main process
+TRANSCRIBE_NUM_WORKERS = 1
+# the audio is cut at the quietest point within TRANSCRIBE_CHUNK_SEARCH_SECONDS of every TRANSCRIBE_CHUNK_SECONDS
+TRANSCRIBE_CHUNK_SECONDS = 300
+TRANSCRIBE_CHUNK_SEARCH_SECONDS = 30
+# seconds of audio shared by two adjacent chunks
+TRANSCRIBE_CHUNK_OVERLAP = 2
+# transcriptions of the audio files transcribed before, set the path to "" to disable the cache
+TRANSCRIPTION_CACHE_PATH = "transcription_cache.sqlite"
+TRANSCRIPTION_CACHE_MAX_ENTRIES = 500
+TRANSCRIPTION_CACHE_MAX_AGE_DAYS = 90
 
 # translator
 TRANSLATE_WINDOW_SIZE = 1
 TRANSLATE_RETRY_LIMIT = 5
+# the n-th retry waits a random time up to min(CAP, BASE * 2^n) seconds
+TRANSLATE_BACKOFF_BASE = 0.5
+TRANSLATE_BACKOFF_CAP = 8
+# number of sentences sent in one request, 1 translates the sentences one by one
+TRANSLATE_BATCH_SIZE = 1
+# "async" adjusts the number of concurrent requests to the rate limits of the provider, "thread" uses a fixed thread pool
+TRANSLATE_ENGINE = "async"
+TRANSLATE_INITIAL_CONCURRENCY = 8
+TRANSLATE_MAX_CONCURRENCY = 61
+# in the streaming pipeline, the translator waits for this many new sentences before starting a round
+TRANSLATE_STREAM_MIN_SENTENCES = 20
+# seconds to wait when rate limited and the provider does not send Retry-After
+TRANSLATE_RATE_LIMIT_WAIT = 5
+TRANSLATE_REQUEST_TIMEOUT = 120
+# requests and tokens per minute allowed by the account, 0 means no limit
+TRANSLATE_RPM_LIMIT = 0
+TRANSLATE_TPM_LIMIT = 0
+# tokens allowed for one translation job, the job stops when they are used up, 0 means no limit
+TRANSLATE_MAX_TOKENS = 0
+# budget file shared by the local jobs using the same account, "" counts the requests of this job only
+TRANSLATE_BUDGET_FILE = ""
+# router: the providers in order of preference, a provider is skipped for BREAKER_COOLDOWN seconds after BREAKER_FAILURES
+# consecutive failures, a request slower than the HEDGE_PERCENTILE latency of its provider is duplicated on the next one
+TRANSLATE_ROUTER_PROVIDERS = ["gpt", "qwen", "glm"]
+TRANSLATE_BREAKER_FAILURES = 5
+TRANSLATE_BREAKER_COOLDOWN = 30
+TRANSLATE_HEDGE_PERCENTILE = 0.95
+TRANSLATE_HEDGE_MIN_SAMPLES = 20
+# hedge delay in seconds until HEDGE_MIN_SAMPLES latencies are known
+TRANSLATE_HEDGE_DELAY = 10
+# translation cache shared by all the jobs, set the path to "" to disable the cache
+TRANSLATION_CACHE_PATH = "translation_cache.sqlite"
+TRANSLATION_CACHE_MAX_ENTRIES = 200000
+TRANSLATION_CACHE_MAX_AGE_DAYS = 90
+# translation memory of the accepted translations of all the jobs, set the path to "" to disable it
+TRANSLATION_MEMORY_PATH = "translation_memory.sqlite"
+# the most similar pairs are given to the LLM as examples, a pair this similar is reused without calling the LLM
+TRANSLATION_MEMORY_NUM_EXAMPLES = 3
+TRANSLATION_MEMORY_MIN_SIMILARITY = 0.4
+TRANSLATION_MEMORY_REUSE_SIMILARITY = 1.0
+# a lookup scores at most this many pairs, taken from the pairs of the rarest n-grams of the sentence
+TRANSLATION_MEMORY_MAX_CANDIDATES = 300
 CH_EN_RATIO_LIMIT = 3
 PUNCTUATION_MODEL_PATH = ""
+# number of windows of the long lines given to the punctuation model at once
+PUNCTUATION_BATCH_SIZE = 16
 
 # spliter
 SPACY_EN_MODEL = "en_core_web_trf"
 SPACY_CH_MODEL = "zh_core_web_trf"
+# split engine of the chinese sentences: trf, md, sm, or rule for the punctuation and function word rules without spacy
+SPLITER_ENGINE = "trf"
+SPACY_CH_MODELS = {"trf": SPACY_CH_MODEL, "md": "zh_core_web_md", "sm": "zh_core_web_sm"}
+# the split only uses the dependency parse, the other components of the chinese model are disabled
+SPACY_CH_PIPES = ["transformer", "tok2vec", "parser"]
+# number of fragments parsed together by nlp.pipe
+SPACY_BATCH_SIZE = 64
+# number of worker processes of the spliter, each loads its own spacy model, 0 for one per CPU
+SPLITER_NUM_WORKERS = 1
+# number of sentences given to a worker at once
+SPLITER_CHUNK_SIZE = 50
+# fragments of the sentence pairs split before, set the path to "" to disable the cache
+SPLITER_CACHE_PATH = "spliter_cache.sqlite"
+SPLITER_CACHE_MAX_ENTRIES = 200000
+SPLITER_CACHE_MAX_AGE_DAYS = 90
 
 # save_dir
 SAVE_DIR = "D:\\Documents\\TranslateVideo"
 
-# LLM
+# LLM, "auto" routes the requests across TRANSLATE_ROUTER_PROVIDERS
 LLM = "gpt"
+GPT_MODEL = "gpt-3.5-turbo-ca"
+QWEN_MODEL = "qwen-plus"
+GLM_MODEL = "glm-4"
+# GPT_BASE_URL = "https://api.chatgptid.net/v1"
+GPT_BASE_URL = "https://api.chatanywhere.tech/v1"
+QWEN_BASE_URL = "https://dashscope.aliyuncs.com/api/v1"
 
 # API_KEY
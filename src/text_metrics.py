@@ -0,0 +1,41 @@
+import re
+from functools import lru_cache
+from itertools import accumulate
+
+# The display length of a text: every non-ascii character counts as one, and so does every ascii word.
+# An ascii character starts a unit after a non-ascii character, and a space always starts one,
+# so a space with the word after it counts as one.
+ASCII_UNIT_PATTERN = re.compile(r'[\x00-\x7f][\x00-\x1f\x21-\x7f]*')
+CH_UNIT_PATTERN = re.compile(r'[^\x00-\x7f]|[\x00-\x7f][\x00-\x1f\x21-\x7f]*')
+CACHE_SIZE = 1 << 16
+
+def count_ch_units(text):
+    if text.isascii():
+        return text.count(' ') + (1 if text and text[0] != ' ' else 0)
+    # The non-ascii characters are counted by the encoder, only the few ascii words go through the regex
+    return len(text) - len(text.encode('ascii', 'ignore')) + len(ASCII_UNIT_PATTERN.findall(text))
+
+# The same fragments are measured again and again while splitting and checking the translations
+@lru_cache(maxsize=CACHE_SIZE)
+def ch_len(text):
+    return count_ch_units(text)
+
+# Prefix sums of the unit starts of a text, the length of any slice of the text is then O(1)
+class TextMetrics:
+    def __init__(self, text):
+        self.text = text
+        starts = bytearray(len(text))
+        for match in CH_UNIT_PATTERN.finditer(text):
+            starts[match.start()] = 1
+        self.starts = starts
+        self.prefix = list(accumulate(starts, initial=0))
+
+    def span_len(self, start, end):
+        # ch_len(text[start:end]), the first character of a slice always starts a unit
+        if start >= end:
+            return 0
+        return self.prefix[end] - self.prefix[start] + (1 - self.starts[start])
+
+@lru_cache(maxsize=256)
+def get_text_metrics(text):
+    return TextMetrics(text)
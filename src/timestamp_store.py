@@ -0,0 +1,87 @@
+import json
+import numpy as np
+
+# The word timestamps as columns: the words, and their start and end times in float64 arrays, NaN when unknown.
+class Timestamps:
+    def __init__(self, words, starts, ends):
+        self.words = words
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def from_list(cls, timestamps):
+        return cls([timestamp['word'] for timestamp in timestamps],
+                   [np.nan if timestamp.get('start') is None else timestamp['start'] for timestamp in timestamps],
+                   [np.nan if timestamp.get('end') is None else timestamp['end'] for timestamp in timestamps])
+
+    def to_list(self):
+        return [{'word': word, 'start': None if np.isnan(start) else float(start), 'end': None if np.isnan(end) else float(end)}
+                for word, start, end in zip(self.words, self.starts.tolist(), self.ends.tolist())]
+
+    def select(self, indices):
+        return Timestamps([self.words[i] for i in indices], self.starts[indices], self.ends[indices])
+
+def fill_gaps(starts, ends):
+    # Every run of words without a start gets the time between the end of the word before the run and the start of
+    # the word after it, split evenly. The words before the run without an end are filled with the run.
+    # The first run starts at 0, and the last run ends at the end of the word before it.
+    starts = np.array(starts, dtype=np.float64)
+    ends = np.array(ends, dtype=np.float64)
+    num_words = len(starts)
+    missing = np.isnan(starts)
+    if not missing.any():
+        return starts, ends
+
+    # The runs of missing starts are [run_starts, run_ends)
+    edges = np.diff(np.concatenate(([0], missing.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    # The last word with an end before every run, a word filled for the previous run has one
+    last_ends = np.maximum.accumulate(np.where(np.isnan(ends), -1, np.arange(num_words)))
+    previous = np.where(run_starts > 0, last_ends[np.maximum(run_starts-1, 0)], -1)
+    previous = np.maximum(previous, np.concatenate(([-1], run_ends[:-1]-1)))
+
+    start_times = np.where(previous >= 0, ends[np.maximum(previous, 0)], 0.0)
+    # Only the last run can end at the end of the words, the others end at the start of the word after them
+    end_times = starts[np.minimum(run_ends, num_words-1)]
+    # A run starting right after the previous one starts where the previous one ends
+    follows = (previous >= 0) & (previous == np.concatenate(([-1], run_ends[:-1]-1)))
+    start_times[follows] = end_times[np.flatnonzero(follows)-1]
+    if run_ends[-1] == num_words:
+        end_times[-1] = start_times[-1]
+    counts = run_ends - previous - 1
+    durations = (end_times - start_times) / counts
+
+    # The position of every filled word in its run, from 0
+    first = np.repeat(previous + 1, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = first + offsets
+    # The end of a word is exactly the start of the next one, and the last word ends exactly at the end of the run
+    run_end_times = np.repeat(end_times, counts)
+    start_times = np.repeat(start_times, counts)
+    durations = np.repeat(durations, counts)
+    starts[positions] = start_times + offsets * durations
+    ends[positions] = np.where(offsets + 1 == np.repeat(counts, counts), run_end_times, start_times + (offsets + 1) * durations)
+    return starts, ends
+
+def save_timestamps(timestamps_path, timestamps):
+    # The words are stored as one utf-8 buffer, a word never has a new line
+    words = np.frombuffer('\n'.join(timestamps.words).encode('utf-8'), dtype=np.uint8)
+    np.savez(timestamps_path, words=words, starts=timestamps.starts, ends=timestamps.ends)
+
+def load_timestamps(timestamps_path):
+    # timestamps.npz, or the timestamps.json of the former runs
+    if timestamps_path.endswith('.json'):
+        with open(timestamps_path, 'r', encoding='utf-8') as f:
+            return Timestamps.from_list(json.load(f))
+    with np.load(timestamps_path) as data:
+        words = data['words'].tobytes().decode('utf-8')
+        return Timestamps(words.split('\n') if words else [], data['starts'], data['ends'])
+
+def write_timestamps_json(timestamps_path, timestamps):
+    # For review, one word per line
+    with open(timestamps_path, 'w', encoding='utf-8') as f:
+        f.write('[\n' + ',\n'.join([json.dumps(timestamp, ensure_ascii=False) for timestamp in timestamps.to_list()]) + '\n]\n')
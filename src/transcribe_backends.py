@@ -0,0 +1,149 @@
+import sys
+import logging
+import importlib
+import subator_constants
+import audio_pcm
+
+# The backends log to the transcriber log
+logger = logging.getLogger("transcriber")
+
+# Every backend resamples the audio to the rate of the whisper models
+SAMPLE_RATE = audio_pcm.SAMPLE_RATE
+BACKENDS = {}
+
+def register_backend(backend_class):
+    BACKENDS[backend_class.name] = backend_class
+    return backend_class
+
+def get_backend_class(name):
+    return BACKENDS.get(name)
+
+# A speech recognition library. Every backend gives the result of whisper's transcribe:
+# {'text', 'segments', 'language'}, every segment has the 'words' with 'word', 'start' and 'end'.
+# The libraries are imported when the backend is built, only the one in use must be installed.
+class TranscribeBackend:
+    name = ''
+    display_name = ''
+
+    def __init__(self, model_name=None, num_threads=None):
+        if model_name is None:
+            model_name = subator_constants.TRANSCRIBE_MODEL
+        if num_threads is None:
+            num_threads = subator_constants.TRANSCRIBE_NUM_THREADS
+        self.model_name = model_name
+        self.num_threads = num_threads
+        self.model = None
+
+    def get_options(self):
+        # Everything other than the audio that can change the result
+        return {'backend': self.name, 'model': self.model_name}
+
+    def load_model(self):
+        raise NotImplementedError
+
+    def get_model(self):
+        if self.model is None:
+            logger.info(f"Loading {self.display_name} model {self.model_name} with {self.num_threads or 'default'} threads")
+            self.model = self.load_model()
+        return self.model
+
+    def transcribe(self, audio, verbose=None, on_segments=None):
+        # audio is the 16 kHz samples. on_segments is called with the segments as soon as they are final.
+        raise NotImplementedError
+
+@register_backend
+class WhisperBackend(TranscribeBackend):
+    name = 'whisper'
+    display_name = 'Whisper'
+
+    def __init__(self, model_name=None, num_threads=None):
+        super().__init__(model_name, num_threads)
+        self.whisper = importlib.import_module('whisper')
+
+    def load_model(self):
+        if self.num_threads > 0:
+            torch = importlib.import_module('torch')
+            torch.set_num_threads(self.num_threads)
+        return self.whisper.load_model(self.model_name)
+
+    def transcribe(self, audio, verbose=None, on_segments=None):
+        model = self.get_model()
+        if on_segments is None:
+            return model.transcribe(audio=audio, verbose=verbose, word_timestamps=True)
+
+        # Whisper has no callback, the words of a window are final when add_word_timestamps is called for the next window
+        whisper_transcribe = importlib.import_module('whisper.transcribe')
+        add_word_timestamps = whisper_transcribe.add_word_timestamps
+        last_segments = []
+
+        def flush_segments():
+            if last_segments:
+                on_segments(list(last_segments))
+            last_segments.clear()
+
+        def add_word_timestamps_and_stream(*args, **kwargs):
+            flush_segments()
+            add_word_timestamps(*args, **kwargs)
+            last_segments.extend(kwargs['segments'] if 'segments' in kwargs else args[0])
+
+        whisper_transcribe.add_word_timestamps = add_word_timestamps_and_stream
+        try:
+            result = model.transcribe(audio=audio, verbose=verbose, word_timestamps=True)
+            flush_segments()
+        finally:
+            whisper_transcribe.add_word_timestamps = add_word_timestamps
+        return result
+
+# CTranslate2 with int8 weights on the CPU, several times faster than the fp32 PyTorch model and a fraction of its memory
+@register_backend
+class FasterWhisperBackend(TranscribeBackend):
+    name = 'faster_whisper'
+    display_name = 'faster-whisper'
+
+    def __init__(self, model_name=None, num_threads=None, compute_type=None):
+        super().__init__(model_name, num_threads)
+        if compute_type is None:
+            compute_type = subator_constants.TRANSCRIBE_COMPUTE_TYPE
+        self.compute_type = compute_type
+        self.faster_whisper = importlib.import_module('faster_whisper')
+
+    def get_options(self):
+        options = super().get_options()
+        options['compute_type'] = self.compute_type
+        return options
+
+    def load_model(self):
+        return self.faster_whisper.WhisperModel(self.model_name, device='cpu', compute_type=self.compute_type, cpu_threads=self.num_threads)
+
+    def transcribe(self, audio, verbose=None, on_segments=None):
+        segments_iter, info = self.get_model().transcribe(audio, word_timestamps=True)
+        # The segments are decoded while iterating, each one is final when it comes out
+        segments = []
+        for segment in segments_iter:
+            segment = {
+                'id': len(segments),
+                'seek': segment.seek,
+                'start': segment.start,
+                'end': segment.end,
+                'text': segment.text,
+                'tokens': list(segment.tokens),
+                'temperature': segment.temperature,
+                'avg_logprob': segment.avg_logprob,
+                'compression_ratio': segment.compression_ratio,
+                'no_speech_prob': segment.no_speech_prob,
+                'words': [{'word': word.word, 'start': word.start, 'end': word.end, 'probability': word.probability} for word in segment.words],
+            }
+            if verbose:
+                print(f"[{segment['start']:.2f} --> {segment['end']:.2f}] {segment['text']}", file=sys.stdout, flush=True)
+            segments.append(segment)
+            if on_segments is not None:
+                on_segments([segment])
+        return {'text': ''.join([segment['text'] for segment in segments]), 'segments': segments, 'language': info.language}
+
+def get_backend(name=None, model_name=None, num_threads=None):
+    if name is None:
+        name = subator_constants.TRANSCRIBE_BACKEND
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        return None
+    return backend_class(model_name, num_threads)
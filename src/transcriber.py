@@ -4,13 +4,23 @@ import subator_constants
 import re
 import sys
 import json
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from deepmultilingualpunctuation import PunctuationModel
-import whisper
+import numpy as np
+import audio_chunks
+import audio_pcm
+import transcribe_backends
+from transcription_cache import TranscriptionCache, hash_file
+from timestamp_store import Timestamps, fill_gaps, save_timestamps, write_timestamps_json
 
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8")
+# delay: the worker processes of the spliter import this module too, the log is only opened when written
+file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8", delay=True)
 # formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 # file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
@@ -53,7 +63,8 @@ def process_labeled_words(labeled_words):
     logger.info(f"Segmented sentences: {sentences}")
     return sentences
 
-def segment_line(line, model):
+def segment_line(line, model, labeled_words=None):
+    # labeled_words is the prediction of the model for the line if it is already known
     MAX_LINE_LENGTH = subator_constants.MAX_EN_FRAGMENT_LENGTH*2
     clean_words = get_clean_words(line)
     clean_line = ' '.join(clean_words)
@@ -61,7 +72,8 @@ def segment_line(line, model):
     if len(clean_line) > MAX_LINE_LENGTH:
         logger.info(f"Line is too long: {len(clean_line)} > {MAX_LINE_LENGTH}")
         logger.info(f'    {clean_line}')
-        labeled_words = model.predict(clean_words)
+        if labeled_words is None:
+            labeled_words = model.predict(clean_words)
         segmented_line = process_labeled_words(labeled_words)
         logger.info(f'    Segmented line:')
         for sl in segmented_line:
@@ -71,75 +83,149 @@ def segment_line(line, model):
         sentences.append(clean_line)
     return sentences
 
-def segment_lines(lines):
+def load_punctuation_model():
     if subator_constants.PUNCTUATION_MODEL_PATH == "":
-        model = PunctuationModel()
-    else:
-        model = PunctuationModel(model=subator_constants.PUNCTUATION_MODEL_PATH)
-    
+        return PunctuationModel()
+    return PunctuationModel(model=subator_constants.PUNCTUATION_MODEL_PATH)
+
+# The windows of PunctuationModel.predict
+PUNCTUATION_CHUNK_SIZE = 230
+PUNCTUATION_OVERLAP = 5
+
+def get_punctuation_windows(words):
+    overlap = PUNCTUATION_OVERLAP if len(words) > PUNCTUATION_CHUNK_SIZE else 0
+    windows = [words[i:i+PUNCTUATION_CHUNK_SIZE] for i in range(0, len(words), PUNCTUATION_CHUNK_SIZE-overlap)]
+    # if the last window is smaller than the overlap, it is removed
+    if len(windows[-1]) <= overlap:
+        windows.pop()
+    return windows
+
+def predict_lines(model, lines_words):
+    # PunctuationModel.predict of every line, the windows of all the lines are run through the pipeline in batches
+    lines_windows = [get_punctuation_windows(words) for words in lines_words]
+    texts = [" ".join(window) for windows in lines_windows for window in windows]
+    results = iter(model.pipe(texts, batch_size=subator_constants.PUNCTUATION_BATCH_SIZE))
+    lines_labeled_words = []
+    for words, windows in zip(lines_words, lines_windows):
+        overlap = PUNCTUATION_OVERLAP if len(words) > PUNCTUATION_CHUNK_SIZE else 0
+        labeled_words = []
+        for window in windows:
+            # Same as predict, the last window is used completely, and so is every window after one equal to it
+            if window == windows[-1]:
+                overlap = 0
+            text = " ".join(window)
+            result = next(results)
+            assert len(text) == result[-1]["end"], "chunk size too large, text got clipped"
+
+            char_index = 0
+            result_index = 0
+            for word in window[:len(window)-overlap]:
+                char_index += len(word) + 1
+                # if any subtoken of a word is labeled as sentence end, the whole word is labeled as sentence end
+                label = 0
+                while result_index < len(result) and char_index > result[result_index]["end"]:
+                    label = result[result_index]['entity']
+                    score = result[result_index]['score']
+                    result_index += 1
+                labeled_words.append([word, label, score])
+        assert len(labeled_words) == len(words)
+        lines_labeled_words.append(labeled_words)
+    return lines_labeled_words
+
+def segment_lines(lines):
+    MAX_LINE_LENGTH = subator_constants.MAX_EN_FRAGMENT_LENGTH*2
+    lines_words = [get_clean_words(line) for line in lines]
+    long_indices = [i for i, words in enumerate(lines_words) if len(' '.join(words)) > MAX_LINE_LENGTH]
+
+    # The model is only loaded if there is a long line, all the long lines are predicted together
+    model = None
+    lines_labeled_words = {}
+    if long_indices:
+        model = load_punctuation_model()
+        start = time.perf_counter()
+        predictions = predict_lines(model, [lines_words[i] for i in long_indices])
+        elapsed = time.perf_counter() - start
+        lines_labeled_words = dict(zip(long_indices, predictions))
+        logger.info(f"Punctuation of {len(long_indices)} long lines predicted in {elapsed:.2f} seconds, {len(long_indices)/max(elapsed, 1e-9):.2f} lines per second")
+
     sentences = []
-    for line in lines:
-        sentences.extend(segment_line(line, model))
+    for i, line in enumerate(lines):
+        sentences.extend(segment_line(line, model, lines_labeled_words.get(i)))
     sentences = [sentence.strip() for sentence in sentences]
     sentences = [sentence for sentence in sentences if sentence]
     return sentences
 
 def preprocess_transcription(text):
-    text = text.split()
+    # Cuts the text into lines at the words ending with a final punctuation
     lines = []
-    line = ''
-    for word in text:
+    line_words = []
+    for word in text.split():
+        line_words.append(word)
         if word[-1] in ['.', '!', '?', ':']:
-            line += word
-            lines.append(line)
-            line = ''
-        else:
-            line += word + ' '
-    if line:
-        lines.append(line)
+            lines.append(' '.join(line_words))
+            line_words = []
+    if line_words:
+        lines.append(' '.join(line_words))
     lines = [line.strip() for line in lines]
     lines = [line for line in lines if line]
     return lines
-    
-def merge_short_lines(sentences):
-    # Merge short lines from end to start
-    sentences.reverse()
-    i = 0
-    while i+1 < len(sentences):
-        if len(sentences[i+1].split()) < 5:
-            if sentences[i+1][-1] in [',', '.', '!', '?', ':']:
-                sentences[i] = sentences[i+1] + ' ' + sentences[i]
+
+# Merges the segmented sentences in one pass. A run of short sentences is merged into the first sentence of
+# at least 5 words that follows, then the merged sentences are merged while they are shorter than MAX_EN_FRAGMENT_LENGTH.
+# A sentence is handed to on_sentence as soon as the next sentences can no longer change it.
+class SentenceMerger:
+    def __init__(self, on_sentence):
+        self.on_sentence = on_sentence
+        self.short_sentences = []
+        self.merging_sentence = None
+
+    def add_sentence(self, sentence):
+        self.short_sentences.append(sentence)
+        if len(sentence.split()) >= 5:
+            self.end_short_sentences()
+
+    def end_short_sentences(self):
+        parts = []
+        for short_sentence in self.short_sentences[:-1]:
+            parts.append(short_sentence)
+            if short_sentence[-1] in [',', '.', '!', '?', ':']:
+                parts.append(' ')
             else:
-                sentences[i] = sentences[i+1] + ', ' + sentences[i]
-            del sentences[i+1]
-        else:
-            i += 1
-    sentences.reverse()
-
-    # i = 0
-    # while i+1 < len(sentences):
-    #     if sentences[i][-1].isdigit() and sentences[i+1][0].isdigit():
-    #         sentences[i] = sentences[i] + ', ' + sentences[i+1]
-    #         del sentences[i+1]
-    #     else:
-    #         i += 1
-
-
-    MAX_LINE_LENGTH = subator_constants.MAX_EN_FRAGMENT_LENGTH
-    i = 0
-    while i+1 < len(sentences):
-        if len(sentences[i]) + len(sentences[i+1]) < int(MAX_LINE_LENGTH):
-            logger.info(f"Merge sentence {sentences[i]} with {sentences[i+1]}")
+                parts.append(', ')
+        parts.append(self.short_sentences[-1])
+        self.short_sentences = []
+        self.merge_sentence(''.join(parts))
+
+    def merge_sentence(self, sentence):
+        MAX_LINE_LENGTH = subator_constants.MAX_EN_FRAGMENT_LENGTH
+        if self.merging_sentence is None:
+            self.merging_sentence = sentence
+        elif len(self.merging_sentence) + len(sentence) < int(MAX_LINE_LENGTH):
+            logger.info(f"Merge sentence {self.merging_sentence} with {sentence}")
             # clean_word can't distinguish between decimal points and periods after numbers. If the last word of a sentence is a number, it will follow a period. No need to add a period.
-            if sentences[i][-1] in [',', '.', '!', '?', ':']:
-                sentences[i] = sentences[i] + ' ' + sentences[i+1]
+            if self.merging_sentence[-1] in [',', '.', '!', '?', ':']:
+                self.merging_sentence = self.merging_sentence + ' ' + sentence
             else:
-                sentences[i] = sentences[i] + '. '+ sentences[i+1]
-            del sentences[i+1]
+                self.merging_sentence = self.merging_sentence + '. '+ sentence
         else:
-            i += 1
-    logger.info('')
-    return sentences
+            self.on_sentence(self.merging_sentence)
+            self.merging_sentence = sentence
+
+    def finish(self):
+        if self.short_sentences:
+            self.end_short_sentences()
+        if self.merging_sentence is not None:
+            self.on_sentence(self.merging_sentence)
+            self.merging_sentence = None
+        logger.info('')
+
+def merge_short_lines(sentences):
+    merged_sentences = []
+    merger = SentenceMerger(merged_sentences.append)
+    for sentence in sentences:
+        merger.add_sentence(sentence)
+    merger.finish()
+    return merged_sentences
 
 def process_transcription(text):
     lines = preprocess_transcription(text)
@@ -147,45 +233,135 @@ def process_transcription(text):
     sentences = merge_short_lines(sentences)
     return sentences
 
+# The incremental version of process_transcription, it gives the same sentences.
+# A line is complete at its final punctuation, its sentences are merged by a SentenceMerger.
+# Like segment_lines, the punctuation model is only loaded if there is a long line.
+class SentenceStream:
+    def __init__(self, punctuation_model, on_sentence):
+        self.punctuation_model = punctuation_model
+        self.on_sentence = on_sentence
+        self.line_words = []
+        self.sentences = []
+        self.merger = SentenceMerger(self.emit)
+
+    def add_word(self, word):
+        for word in word.split():
+            self.line_words.append(word)
+            if word[-1] in ['.', '!', '?', ':']:
+                self.end_line()
+
+    def end_line(self):
+        line = ' '.join(self.line_words)
+        self.line_words = []
+        if not line:
+            return
+        clean_words = get_clean_words(line)
+        labeled_words = None
+        if len(' '.join(clean_words)) > subator_constants.MAX_EN_FRAGMENT_LENGTH*2:
+            if self.punctuation_model is None:
+                self.punctuation_model = load_punctuation_model()
+            labeled_words = self.punctuation_model.predict(clean_words)
+        for sentence in segment_line(line, self.punctuation_model, labeled_words):
+            sentence = sentence.strip()
+            if sentence:
+                self.merger.add_sentence(sentence)
+
+    def emit(self, sentence):
+        self.sentences.append(sentence)
+        self.on_sentence(sentence)
+
+    def finish(self):
+        self.end_line()
+        self.merger.finish()
+        return self.sentences
+
+def transcribe_streaming(transcribe, sentence_queue):
+    # transcribe is called with the callback of the final segments, their words are segmented in another thread
+    # and the sentences are put into sentence_queue as soon as they are complete.
+    word_queue = queue.Queue()
+    streamed_words = []
+
+    def on_segments(segments):
+        for segment in segments:
+            for word_segment in segment['words']:
+                streamed_words.append(word_segment['word'])
+                word_queue.put(word_segment['word'])
+
+    stream = SentenceStream(None, lambda sentence: sentence_queue.put(('sentence', sentence)))
+    def segment_words():
+        while True:
+            word = word_queue.get()
+            if word is None:
+                break
+            stream.add_word(word)
+        stream.finish()
+    segment_thread = threading.Thread(target=segment_words)
+    segment_thread.start()
+
+    try:
+        result = transcribe(on_segments)
+    finally:
+        word_queue.put(None)
+        segment_thread.join()
+    return result, streamed_words, stream.sentences
+
+def get_backend(backend_name, num_threads=None):
+    backend = transcribe_backends.get_backend(backend_name, num_threads=num_threads)
+    if backend is None:
+        logger.error(f"Invalid transcribe backend: {backend_name}")
+        exit(1)
+    return backend
+
+def init_transcribe_worker(backend_name, num_threads):
+    global worker_backend
+    # The workers share the cores, each one gets its part of the threads
+    worker_backend = get_backend(backend_name, num_threads)
+    worker_backend.get_model()
+
+def transcribe_chunk(pcm_path, start, end):
+    # The worker maps the decoded audio itself, only the positions of the chunk are sent
+    return worker_backend.transcribe(audio_pcm.open_pcm(pcm_path)[start:end])
+
+def transcribe_chunks(backend, pcm_path, num_workers, on_segments=None):
+    # Splits the audio at silences and transcribes the chunks in worker processes, one model per worker.
+    # The chunks overlap by TRANSCRIBE_CHUNK_OVERLAP seconds so that a word at a cut is heard whole,
+    # the words are moved back to the time of the whole audio and the words of the overlaps are kept once.
+    SAMPLE_RATE = audio_pcm.SAMPLE_RATE
+    audio = audio_pcm.open_pcm(pcm_path)
+    cuts = audio_chunks.find_silence_cuts(audio, SAMPLE_RATE, subator_constants.TRANSCRIBE_CHUNK_SECONDS, subator_constants.TRANSCRIBE_CHUNK_SEARCH_SECONDS)
+    chunks = audio_chunks.get_chunks(len(audio), cuts, int(subator_constants.TRANSCRIBE_CHUNK_OVERLAP*SAMPLE_RATE))
+    num_workers = min(num_workers, len(chunks))
+    num_threads = backend.num_threads or max(1, os.cpu_count() // num_workers)
+    logger.info(f"Transcribing {len(audio)/SAMPLE_RATE:.2f} seconds of audio in {len(chunks)} chunks with {num_workers} workers of {num_threads} threads")
+    segments = []
+    language = None
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_transcribe_worker, initargs=(backend.name, num_threads)) as executor:
+        # map returns the chunks in order
+        results = executor.map(transcribe_chunk, [pcm_path]*len(chunks), [chunk[0] for chunk in chunks], [chunk[1] for chunk in chunks])
+        for i, (chunk, result) in enumerate(zip(chunks, results)):
+            chunk_segments = audio_chunks.offset_chunk_segments(result['segments'], chunk, SAMPLE_RATE, i == 0, i == len(chunks)-1, len(segments))
+            logger.info(f"Chunk {i+1}/{len(chunks)} transcribed: {chunk[2]/SAMPLE_RATE:.2f} - {chunk[3]/SAMPLE_RATE:.2f} seconds, {sum([len(segment['words']) for segment in chunk_segments])} words")
+            segments.extend(chunk_segments)
+            if language is None:
+                language = result['language']
+            if on_segments is not None:
+                on_segments(chunk_segments)
+    return {'text': ''.join([segment['text'] for segment in segments]), 'segments': segments, 'language': language}
+
 def process_timestamps(word_segments):
-    timestamps = []
+    words = []
     for segment in word_segments:
         # Handle the bug of WhisperX
         word = segment['word']
         if word == 'JR.:':
             word = 'JR.'
-        word = get_clean_word(word)
-
-        start_time = segment['start'] if 'start' in segment else None
-        end_time = segment['end'] if 'end' in segment else None
-        timestamps.append({'word': word, 'start': start_time, 'end': end_time})
-    
-    i = 0
-    while i < len(timestamps):
-        if timestamps[i]['start'] is None:
-            j = i-1
-            while j >= 0 and timestamps[j]['end'] is None:
-                j -= 1
-            k = i+1
-            while k < len(timestamps) and timestamps[k]['start'] is None:
-                k += 1
-            
-            start_time_of_words = timestamps[j]['end'] if j >= 0 else 0
-            end_time_of_words = timestamps[k]['start'] if k < len(timestamps) else timestamps[j]['end']
-            duration = end_time_of_words - start_time_of_words
-            word_count = k - j - 1
-            word_duration = duration / word_count
-            for l in range(j+1, k):
-                timestamps[l]['start'] = timestamps[l-1]['end']
-                timestamps[l]['end'] = timestamps[l]['start'] + word_duration
-            i = k
-        else:
-            i += 1
-    check_timestamps(word_segments, timestamps)
+        words.append(get_clean_word(word))
+    timestamps = Timestamps.from_list(word_segments)
+    starts, ends = fill_gaps(timestamps.starts, timestamps.ends)
+    check_timestamps(timestamps, starts, ends)
 
     # whisperx may have a bug that ',' is a word. Remove it.
-    timestamps = [timestamp for timestamp in timestamps if timestamp['word']]
-    return timestamps
+    return Timestamps(words, starts, ends).select([i for i, word in enumerate(words) if word])
 
 def eliminate_end_puncuation(text):
     if len(text) > 0 and text[-1] in ',.':
@@ -204,52 +380,92 @@ def check_clean_words(words1, words2):
             exit(1)
     logger.info('Cheking clean words passed: All words are equal')
 
-def check_timestamps(word_segments, time_stamps):
+def check_timestamps(word_timestamps, starts, ends):
+    # The filled times must keep every time given by the transcription
     logger.info('Checking timestamps...')
-    if len(word_segments) != len(time_stamps):
-        logger.error(f'Cheking timestamps failed: Lengths are not equal: {len(word_segments)} != {len(time_stamps)}')
+    if len(word_timestamps) != len(starts):
+        logger.error(f'Cheking timestamps failed: Lengths are not equal: {len(word_timestamps)} != {len(starts)}')
         exit(1)
-    for i in range(len(word_segments)):
-        # logger.info(f'{word_segments[i]["word"]} {word_segments[i]["start"] if "start" in word_segments[i] else ""} {word_segments[i]["end"] if "end" in word_segments[i] else ""}')
-        # logger.info(f'{time_stamps[i]["word"]} {time_stamps[i]["start"]} {time_stamps[i]["end"]}')
-        if 'start' in word_segments[i] and word_segments[i]['start'] != time_stamps[i]['start']:
-            logger.error(f'Cheking timestamps failed: Start times are not equal: {word_segments[i]["start"]} != {time_stamps[i]["start"]}')
-            exit(1)
-        if 'end' in word_segments[i] and word_segments[i]['end'] != time_stamps[i]['end']:
-            logger.error(f'Cheking timestamps failed: End times are not equal: {word_segments[i]["end"]} != {time_stamps[i]["end"]}')
+    for name, given, filled in [('Start', word_timestamps.starts, starts), ('End', word_timestamps.ends, ends)]:
+        changed = np.flatnonzero(~np.isnan(given) & (given != filled))
+        if len(changed):
+            logger.error(f'Cheking timestamps failed: {name} times are not equal: {given[changed[0]]} != {filled[changed[0]]}')
             exit(1)
     logger.info('Cheking timestamps passed: All times are equal')
 
-def transcriber(audio_path, output_dir):
+def get_transcribe_options(backend, num_workers):
+    # The chunks are transcribed without the text before them, the chunked transcription may differ from the whole one
+    options = backend.get_options()
+    if num_workers > 1:
+        options['chunk'] = [subator_constants.TRANSCRIBE_CHUNK_SECONDS, subator_constants.TRANSCRIBE_CHUNK_SEARCH_SECONDS, subator_constants.TRANSCRIBE_CHUNK_OVERLAP]
+    return options
+
+def replay_transcription(result, on_segments=None):
+    # A cached transcription is given to the stream in one go
+    if on_segments is not None:
+        on_segments(result['segments'])
+    return result
+
+def transcriber(audio_path, output_dir, sentence_queue=None, num_workers=None, backend_name=None, use_cache=True):
+    if num_workers is None:
+        num_workers = subator_constants.TRANSCRIBE_NUM_WORKERS
+    if num_workers <= 0:
+        num_workers = os.cpu_count()
+    backend = get_backend(backend_name)
     # Create the output directory if it does not exist
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    model = subator_constants.TRANSCRIBE_MODEL
-    model = whisper.load_model("medium.en")
-    result = model.transcribe(audio=audio_path, verbose=True, word_timestamps=True)
+    # The model is not loaded if the same audio was transcribed with the same options before
+    cache = None
+    result = None
+    source_hash = hash_file(audio_path)
+    if use_cache and subator_constants.TRANSCRIPTION_CACHE_PATH:
+        cache = TranscriptionCache(subator_constants.TRANSCRIPTION_CACHE_PATH)
+        cache_key = cache.make_key(source_hash, get_transcribe_options(backend, num_workers))
+        result = cache.get(cache_key)
+    if result is not None:
+        logger.info(f"Transcription of {audio_path} is loaded from the cache")
+        transcribe = lambda on_segments=None: replay_transcription(result, on_segments)
+    else:
+        # The audio is decoded once, every reader maps the same samples
+        pcm_path = audio_pcm.prepare_pcm(audio_path, output_dir, source_hash)
+        if num_workers > 1:
+            transcribe = lambda on_segments=None: transcribe_chunks(backend, pcm_path, num_workers, on_segments)
+        else:
+            transcribe = lambda on_segments=None: backend.transcribe(audio_pcm.open_pcm(pcm_path), verbose=True, on_segments=on_segments)
+    is_cached = result is not None
+    if sentence_queue is None:
+        result = transcribe()
+    else:
+        result, streamed_words, streamed_sentences = transcribe_streaming(transcribe, sentence_queue)
+    if cache is not None:
+        if not is_cached:
+            cache.put(cache_key, result)
+        cache.close()
 
     with open(os.path.join(output_dir, "transcription.json"), 'w') as f:
-        f.write(json.dumps(result, ensure_ascii=False, indent=4))
+        f.write(json.dumps(result, ensure_ascii=False))
     logger.info(f"Transcription is saved to {os.path.join(output_dir, 'transcription.json')}")
     
-    text = ''
     word_segments = []
-
     for segment in result['segments']:
         for word_segment in segment['words']:
             word_segments.append({'word': word_segment['word'], 'start': word_segment['start'], 'end': word_segment['end']})
-            text += word_segment['word'] + ' '
+    text = ' '.join([word_segment['word'] for word_segment in word_segments])
     
-    sentences = process_transcription(text)
+    if sentence_queue is not None and streamed_words == [word_segment['word'] for word_segment in word_segments]:
+        sentences = streamed_sentences
+    else:
+        if sentence_queue is not None:
+            logger.warning("The streamed words are different from the transcription, segmenting the transcription again")
+        sentences = process_transcription(text)
     timestamps = process_timestamps(word_segments)
 
     words1 = []
     for sentence in sentences:
         words1.extend(sentence.split())
-    words2 = []
-    for timestamp in timestamps:
-        words2.append(timestamp['word'])
+    words2 = timestamps.words
     for word1, word2 in zip(words1, words2):
         logger.debug(f'{word1} == {word2}')
     check_clean_words(words1, words2)
@@ -260,19 +476,34 @@ def transcriber(audio_path, output_dir):
             f.write(sentence + '\n')
     logger.info(f"Sentences are saved to {sencences_path}")
 
-    timestamps_path = os.path.join(output_dir, "timestamps.json")
-    with open(timestamps_path, 'w') as f:
-        json.dump(timestamps, f, ensure_ascii=False, indent=4)
+    # The aligner reads timestamps.npz, timestamps.json is for review
+    timestamps_path = os.path.join(output_dir, "timestamps.npz")
+    save_timestamps(timestamps_path, timestamps)
+    write_timestamps_json(os.path.join(output_dir, "timestamps.json"), timestamps)
     logger.info(f"Timestamps are saved to {timestamps_path}")
 
     logger.info("Transcription completed.")
+    if sentence_queue is not None:
+        # The translator checks the streamed sentences against the final ones
+        sentence_queue.put(('done', sentences))
+
+def transcriber_stream(audio_path, output_dir, sentence_queue):
+    # Run in a thread next to translator.translator_stream, which must not wait forever if the transcription fails
+    try:
+        transcriber(audio_path, output_dir, sentence_queue)
+    except BaseException as e:
+        sentence_queue.put(('error', f'{type(e).__name__}: {e}'))
+        raise
 
 if __name__ == "__main__":
     # Parse the command line arguments
     parser = argparse.ArgumentParser(description="Transcribe the audio")
     parser.add_argument("--audio_path", help="Path to the audio file", required=True)
     parser.add_argument("--output_dir", help="Path to the output directory", required=True)
+    parser.add_argument("--num_workers", help="Number of worker processes transcribing the chunks of the audio, 0 for one per CPU", type=int)
+    parser.add_argument("--backend", help="Transcribe backend", choices=sorted(transcribe_backends.BACKENDS))
+    parser.add_argument("--no_cache", help="Do not use the transcription cache", action="store_true")
     args = parser.parse_args()
     
     # Call the transcriber function
-    transcriber(args.audio_path, args.output_dir)
\ No newline at end of file
+    transcriber(args.audio_path, args.output_dir, num_workers=args.num_workers, backend_name=args.backend, use_cache=not args.no_cache)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import subator_constants
+
+# Bump when a change of the transcriber makes the cached transcriptions out of date
+TRANSCRIPTION_VERSION = 1
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# The transcriptions are stored in a sqlite file shared by all the jobs.
+# The key is the hash of the audio bytes and of everything else that can change the transcription.
+class TranscriptionCache:
+    def __init__(self, cache_path, max_entries=None, max_age_days=None):
+        if max_entries is None:
+            max_entries = subator_constants.TRANSCRIPTION_CACHE_MAX_ENTRIES
+        if max_age_days is None:
+            max_age_days = subator_constants.TRANSCRIPTION_CACHE_MAX_AGE_DAYS
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        # Several jobs may use the same file, wait for the other writers instead of failing
+        self.conn = sqlite3.connect(cache_path, timeout=30)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS transcriptions (key TEXT PRIMARY KEY, transcription TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)')
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(audio_hash, options):
+        content = json.dumps([audio_hash, options, TRANSCRIPTION_VERSION], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute('SELECT transcription FROM transcriptions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute('UPDATE transcriptions SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, transcription):
+        now = time.time()
+        self.conn.execute('INSERT OR REPLACE INTO transcriptions (key, transcription, created, last_used) VALUES (?, ?, ?, ?)',
+                          (key, json.dumps(transcription, ensure_ascii=False), now, now))
+        self.conn.commit()
+
+    def evict(self):
+        # Drop the entries not used for max_age_days, then the least recently used ones above max_entries
+        if self.max_age_days:
+            self.conn.execute('DELETE FROM transcriptions WHERE last_used < ?', (time.time() - self.max_age_days*24*3600,))
+        if self.max_entries:
+            self.conn.execute('DELETE FROM transcriptions WHERE key IN (SELECT key FROM transcriptions ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        self.evict()
+        self.conn.close()
@@ -0,0 +1,66 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import subator_constants
+
+# Translations are stored in a sqlite file shared by all the jobs.
+# The key is the hash of everything that can change the response of the LLM.
+class TranslationCache:
+    def __init__(self, cache_path, max_entries=None, max_age_days=None):
+        if max_entries is None:
+            max_entries = subator_constants.TRANSLATION_CACHE_MAX_ENTRIES
+        if max_age_days is None:
+            max_age_days = subator_constants.TRANSLATION_CACHE_MAX_AGE_DAYS
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Several jobs may use the same file, wait for the other writers instead of failing
+        self.conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)')
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(sentence, window_before_str, window_after_str, user_prompt, llm, model):
+        content = json.dumps([sentence.strip(), window_before_str.strip(), window_after_str.strip(), user_prompt, llm, model], ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT translation FROM translations WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute('UPDATE translations SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key, translation):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO translations (key, translation, created, last_used) VALUES (?, ?, ?, ?)', (key, translation, now, now))
+            self.conn.commit()
+
+    def evict(self):
+        # Drop the entries not used for max_age_days, then the least recently used ones above max_entries
+        with self.lock:
+            if self.max_age_days:
+                self.conn.execute('DELETE FROM translations WHERE last_used < ?', (time.time() - self.max_age_days*24*3600,))
+            if self.max_entries:
+                self.conn.execute('DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            self.conn.commit()
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,264 @@
+import os
+import re
+import math
+import time
+import itertools
+import sqlite3
+import zipfile
+import threading
+import numpy as np
+import subator_constants
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+# Bump when a change of the index makes the saved indexes out of date
+INDEX_VERSION = 1
+
+def normalize(sentence):
+    return WORD_PATTERN.findall(sentence.lower())
+
+def get_ngrams(words):
+    # The words and the pairs of adjacent words, the pairs keep the order of the words
+    ngrams = set(words)
+    ngrams.update([f'{words[i]} {words[i+1]}' for i in range(len(words)-1)])
+    return ngrams
+
+def encode_texts(texts):
+    # The texts as one utf-8 buffer and the offsets of the texts in it
+    data = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(data)+1, dtype=np.int64)
+    np.cumsum([len(item) for item in data], out=offsets[1:])
+    return np.frombuffer(b''.join(data), dtype=np.uint8), offsets
+
+def decode_texts(buffer, offsets):
+    data = buffer.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets)-1)]
+
+# Every accepted (English, Chinese) pair of the past runs, stored in a sqlite file shared by all the jobs.
+# The pairs are indexed by their word unigrams and bigrams, a lookup scores the pairs sharing n-grams with the sentence
+# by the Jaccard similarity of the n-gram sets.
+# The candidates come from the postings of the rarest n-grams of the sentence: a pair at least min_similarity similar
+# always shares one of them (prefix filtering). At most max_candidates postings are read, so a sentence made of
+# common words ("the", "and") does not score every pair.
+# The index is kept as flat NumPy arrays in a file next to the sqlite file. A run loads it and only indexes
+# the rows added since it was saved, the pairs added during the run are saved back by close().
+class TranslationMemory:
+    def __init__(self, memory_path, max_candidates=None):
+        if max_candidates is None:
+            max_candidates = subator_constants.TRANSLATION_MEMORY_MAX_CANDIDATES
+        memory_dir = os.path.dirname(memory_path)
+        if memory_dir and not os.path.exists(memory_dir):
+            os.makedirs(memory_dir)
+        self.memory_path = memory_path
+        self.index_path = os.path.splitext(memory_path)[0] + '_index.npz'
+        self.max_candidates = max_candidates
+        self.lock = threading.Lock()
+        self.reset_index()
+        # The pairs indexed since the index was saved
+        self.recent_pairs = {}
+        self.recent_postings = {}
+        # The n-grams of the sentence looked up, reused by every lookup
+        self.marks = np.zeros(0, dtype=bool)
+        self.changed = False
+        self.conn = sqlite3.connect(memory_path, timeout=30, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pairs (sentence TEXT PRIMARY KEY, translation TEXT NOT NULL, created REAL NOT NULL)')
+        self.conn.commit()
+        self.load_index()
+        self.index_new_rows()
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with np.load(self.index_path) as data:
+                if int(data['version']) != INDEX_VERSION:
+                    return
+                ngrams = data['ngrams'].tobytes().decode('utf-8')
+                ngrams = ngrams.split('\n') if ngrams else []
+                self.sentences = decode_texts(data['sentences'], data['sentence_offsets'])
+                self.translations = decode_texts(data['translations'], data['translation_offsets'])
+                keys = data['keys'].tobytes().decode('utf-8')
+                self.keys = keys.split('\n') if keys else []
+                self.pair_offsets = data['pair_offsets']
+                self.pair_ngrams = data['pair_ngrams']
+                self.posting_offsets = data['posting_offsets']
+                self.postings = data['postings']
+                self.indexed_rowid = int(data['indexed_rowid'])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # A broken index is built again from the sqlite file
+            self.reset_index()
+            return
+        self.ngram_ids = dict(zip(ngrams, range(len(ngrams))))
+        self.exact = dict(zip(self.keys, range(len(self.keys))))
+
+    def reset_index(self):
+        self.sentences = []
+        self.translations = []
+        self.keys = []
+        self.exact = {}
+        # The id of an n-gram is its position in the dict
+        self.ngram_ids = {}
+        # The n-gram ids of the saved pairs, and the pair ids of the saved n-grams, as offsets into flat arrays
+        self.pair_offsets = np.zeros(1, dtype=np.int64)
+        self.pair_ngrams = np.zeros(0, dtype=np.int32)
+        self.posting_offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.int32)
+        self.indexed_rowid = 0
+
+    def index_new_rows(self):
+        # The rows written since the index was saved, by this job or by the others. A replaced row has a new rowid.
+        rows = self.conn.execute('SELECT rowid, sentence, translation FROM pairs WHERE rowid > ? ORDER BY rowid', (self.indexed_rowid,)).fetchall()
+        for rowid, sentence, translation in rows:
+            self.index_pair(sentence, translation)
+            self.indexed_rowid = rowid
+
+    def index_pair(self, sentence, translation):
+        words = normalize(sentence)
+        if not words:
+            return
+        key = ' '.join(words)
+        self.changed = True
+        if key in self.exact:
+            # A newer translation of the same sentence replaces the older one
+            self.translations[self.exact[key]] = translation
+            return
+        pair_id = len(self.sentences)
+        self.sentences.append(sentence)
+        self.translations.append(translation)
+        self.keys.append(key)
+        self.exact[key] = pair_id
+        ngram_ids = [self.ngram_ids.setdefault(ngram, len(self.ngram_ids)) for ngram in get_ngrams(words)]
+        self.recent_pairs[pair_id] = ngram_ids
+        for ngram_id in ngram_ids:
+            self.recent_postings.setdefault(ngram_id, []).append(pair_id)
+
+    def add(self, sentence, translation):
+        sentence = sentence.strip()
+        translation = translation.strip()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO pairs (sentence, translation, created) VALUES (?, ?, ?)', (sentence, translation, time.time()))
+            self.conn.commit()
+            self.index_pair(sentence, translation)
+
+    def compact(self):
+        # Moves the recent pairs into the flat arrays
+        if not self.recent_pairs:
+            return
+        recent_ids = sorted(self.recent_pairs)
+        recent_sizes = [len(self.recent_pairs[pair_id]) for pair_id in recent_ids]
+        recent_ngrams = np.fromiter(itertools.chain.from_iterable([self.recent_pairs[pair_id] for pair_id in recent_ids]), dtype=np.int32, count=sum(recent_sizes))
+        self.pair_ngrams = np.concatenate((self.pair_ngrams, recent_ngrams))
+        self.pair_offsets = np.concatenate((self.pair_offsets, self.pair_offsets[-1] + np.cumsum(recent_sizes, dtype=np.int64)))
+        # The postings of every n-gram are the pairs having it, in the order of the pairs
+        num_pairs = len(self.pair_offsets) - 1
+        pair_of_ngram = np.repeat(np.arange(num_pairs, dtype=np.int32), np.diff(self.pair_offsets))
+        self.postings = pair_of_ngram[np.argsort(self.pair_ngrams, kind='stable')]
+        self.posting_offsets = np.zeros(len(self.ngram_ids)+1, dtype=np.int64)
+        np.cumsum(np.bincount(self.pair_ngrams, minlength=len(self.ngram_ids)), out=self.posting_offsets[1:])
+        self.recent_pairs = {}
+        self.recent_postings = {}
+
+    def save_index(self):
+        self.compact()
+        sentences, sentence_offsets = encode_texts(self.sentences)
+        translations, translation_offsets = encode_texts(self.translations)
+        # The n-grams and the keys never have a new line
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, version=INDEX_VERSION, indexed_rowid=self.indexed_rowid,
+                 ngrams=np.frombuffer('\n'.join(self.ngram_ids).encode('utf-8'), dtype=np.uint8),
+                 keys=np.frombuffer('\n'.join(self.keys).encode('utf-8'), dtype=np.uint8),
+                 sentences=sentences, sentence_offsets=sentence_offsets,
+                 translations=translations, translation_offsets=translation_offsets,
+                 pair_offsets=self.pair_offsets, pair_ngrams=self.pair_ngrams,
+                 posting_offsets=self.posting_offsets, postings=self.postings)
+        os.replace(tmp_path, self.index_path)
+        self.changed = False
+
+    def get_document_frequency(self, ngram_id):
+        frequency = len(self.recent_postings.get(ngram_id, ()))
+        if ngram_id < len(self.posting_offsets) - 1:
+            frequency += int(self.posting_offsets[ngram_id+1] - self.posting_offsets[ngram_id])
+        return frequency
+
+    def get_candidates(self, ngram_ids):
+        # The saved pairs and the recent pairs sharing an n-gram with the sentence, from the rarest n-gram
+        budget = self.max_candidates
+        postings = []
+        recent_candidates = set()
+        for ngram_id in ngram_ids:
+            if budget <= 0:
+                break
+            if ngram_id < len(self.posting_offsets) - 1:
+                start = self.posting_offsets[ngram_id]
+                end = min(self.posting_offsets[ngram_id+1], start + budget)
+                postings.append(self.postings[start:end])
+                budget -= end - start
+            recent = self.recent_postings.get(ngram_id)
+            if recent is not None and budget > 0:
+                recent_candidates.update(recent[:budget])
+                budget -= len(recent)
+        candidates = np.unique(np.concatenate(postings)) if postings else np.zeros(0, dtype=np.int32)
+        return candidates, recent_candidates
+
+    def count_shared(self, candidates, ngram_ids):
+        # The number of n-grams of the sentence every saved candidate has
+        if len(self.marks) < len(self.ngram_ids):
+            self.marks = np.zeros(2*len(self.ngram_ids), dtype=bool)
+        self.marks[ngram_ids] = True
+        starts = self.pair_offsets[candidates]
+        sizes = self.pair_offsets[candidates+1] - starts
+        firsts = np.cumsum(sizes) - sizes
+        positions = np.repeat(starts - firsts, sizes) + np.arange(sizes.sum())
+        shared = np.add.reduceat(self.marks[self.pair_ngrams[positions]], firsts, dtype=np.int64)
+        self.marks[ngram_ids] = False
+        return shared, sizes
+
+    def lookup(self, sentence, k=None, min_similarity=None):
+        # Returns up to k (similarity, sentence, translation) of the most similar pairs, most similar first
+        if k is None:
+            k = subator_constants.TRANSLATION_MEMORY_NUM_EXAMPLES
+        if min_similarity is None:
+            min_similarity = subator_constants.TRANSLATION_MEMORY_MIN_SIMILARITY
+        words = normalize(sentence)
+        if not words or k <= 0:
+            return []
+        with self.lock:
+            pair_id = self.exact.get(' '.join(words))
+            if pair_id is not None and k == 1:
+                return [(1.0, self.sentences[pair_id], self.translations[pair_id])]
+            ngrams = get_ngrams(words)
+            ngram_ids = [self.ngram_ids[ngram] for ngram in ngrams if ngram in self.ngram_ids]
+            # The n-grams unknown to the memory are the rarest ones, they take their place in the prefix
+            prefix_length = len(ngrams) - math.ceil(min_similarity*len(ngrams) - 1e-9) + 1 - (len(ngrams) - len(ngram_ids))
+            ngram_ids.sort(key=lambda ngram_id: (self.get_document_frequency(ngram_id), ngram_id))
+            candidates, recent_candidates = self.get_candidates(ngram_ids[:max(0, prefix_length)])
+
+            matches = {}
+            if len(candidates):
+                shared, sizes = self.count_shared(candidates, ngram_ids)
+                similarities = shared / (len(ngrams) + sizes - shared)
+                selected = similarities >= min_similarity
+                matches.update(zip(candidates[selected].tolist(), similarities[selected].tolist()))
+            if recent_candidates:
+                ngram_id_set = set(ngram_ids)
+                for candidate in recent_candidates:
+                    num_shared = len(ngram_id_set.intersection(self.recent_pairs[candidate]))
+                    similarity = num_shared / (len(ngrams) + len(self.recent_pairs[candidate]) - num_shared)
+                    if similarity >= min_similarity:
+                        matches[candidate] = similarity
+            if pair_id is not None:
+                matches[pair_id] = 1.0
+            matches = sorted([(similarity, pair_id) for pair_id, similarity in matches.items()], key=lambda match: (-match[0], match[1]))
+            return [(similarity, self.sentences[pair_id], self.translations[pair_id]) for similarity, pair_id in matches[:k]]
+
+    def close(self):
+        with self.lock:
+            # The rows of the other jobs are indexed too, the saved index covers every row up to indexed_rowid
+            self.index_new_rows()
+            if self.changed:
+                self.save_index()
+            self.conn.close()
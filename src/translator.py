@@ -2,29 +2,36 @@ import os
 import argparse
 import sys
 import spacy
-from zhipuai import ZhipuAI
-import random
-from http import HTTPStatus
-import dashscope
 import subator_constants
 import logging
 import time
 import re
-from openai import OpenAI
+import random
+import asyncio
 from deepmultilingualpunctuation import PunctuationModel
 from opencc import OpenCC
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory
+from text_metrics import ch_len
+from llm_providers import get_provider
+from llm_budget import BudgetScheduler, BudgetExceeded
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8")
+# delay: the worker processes of the spliter import this module too, the log is only opened when written
+file_handler = logging.FileHandler(f"{__name__}.log", mode="w", encoding="utf-8", delay=True)
 formatter = logging.Formatter("%(asctime)s - %(message)s")
 file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 stream_handler = logging.StreamHandler(sys.stdout)
 logger.addHandler(stream_handler)
 
-gpt_client = None
+# Converting the traditional chinese characters, built once and reused
+t2s = OpenCC('t2s')
+
+# Set by translator() when the requests or tokens are limited
+budget_scheduler = None
 
 def is_sentence_start(sent):
     start_set = ['so', 'and', 'but', 'or', 'if', 'when', 'because', 'then', 'i']
@@ -51,96 +58,6 @@ def get_sentences(sentences_file_path):
         sentences = f.readlines()
     return sentences
 
-def call_gpt_api(index, messages, api_key):
-    logger.debug(f"\t\tSentence {index}:\tCalling GPT API")
-    content_translated = ''
-    token_used = 0
-    response_valid = True
-    try:
-        response = gpt_client.chat.completions.create(
-            model="gpt-3.5-turbo-ca",
-            messages=messages,
-        )
-        content_translated = response.choices[0].message.content
-        token_used = response.usage.total_tokens
-    except Exception as e:
-        logger.error(f'\t\tSentence {index}:\tError calling GPT API: {e}')
-        content_translated = '调用GPT API出错。'
-        response_valid = False
-
-    logger.debug(f"\t\tSentence {index}:\tResponse: {content_translated}")
-    return content_translated, token_used, response_valid
-
-def call_qwen_api(index, messages, api_key):
-    logger.debug(f"\t\tSentence {index}:\tCalling Qwen API")
-    content_translated = ''
-    token_used = 0
-    response_valid = True
-    try:
-        dashscope.api_key = api_key
-        response = dashscope.Generation.call(
-            model='qwen-plus',
-            messages=messages,
-            # set the random seed, optional, default to 1234 if not set
-            seed=random.randint(1, 10000),
-            result_format='message',  # set the result to be "message" format.
-        )
-        if response.status_code == HTTPStatus.OK:
-            content_translated = response.output.choices[0].message.content
-            token_used = response.usage.total_tokens
-        else:
-            logger.error('\t\tSentence {index}:\tError calling Qwen API: Request id: %s, Status code: %s, error code: %s, error message: %s' % (
-                response.request_id, response.status_code,
-                response.code, response.message
-            ))
-            content_translated = '调用Qwen API出错。'
-            response_valid = False
-            if response.status_code == 429:
-                # wait for 5 seconds and retry
-                time.sleep(5)
-    except Exception as e:
-        logger.error(f'\t\tSentence {index}:\tError calling Qwen API: {e}')
-        content_translated = '调用Qwen API出错。'
-        response_valid = False
-    
-    logger.debug(f"\t\tSentence {index}:\tResponse: {content_translated}")
-    return content_translated, token_used, response_valid
-
-def call_glm_api(index, messages, api_key):
-    logger.debug(f"\t\tSentence {index}:\tCalling GLM API")
-    content_translated = ''
-    token_used = 0
-    response_valid = True
-    try:
-        client = ZhipuAI(api_key=api_key) # replace with your own API key
-        response = client.chat.completions.create(
-            model="glm-4",  # model name
-            messages=messages,  # messages
-        )
-        content_translated = response.choices[0].message.content
-        token_used = response.usage.total_tokens
-    except Exception as e:
-        logger.error(f'\t\tSentence {index}:\tError calling GLM API: {e}')
-        content_translated = '调用GLM API出错。'
-        response_valid = False
-
-    logger.debug(f"\t\tSentence {index}:\tResponse: {content_translated}")
-    return content_translated, token_used, response_valid
-
-def ch_len(str):
-    length = 0
-    i = 0
-    while i < len(str):
-        if not str[i].isascii():
-            length += 1
-            i += 1
-        else:
-            length += 1
-            i += 1
-            while i < len(str) and str[i].isascii() and str[i] != ' ':
-                i += 1
-    return length
-
 def is_good_response(index, sentence_translated, sentence):
     ratio = ch_len(sentence_translated)/len(sentence.split())
     logger.debug(f"\tSentence {index}:\tRatio: {ratio}")
@@ -158,49 +75,227 @@ def is_good_response(index, sentence_translated, sentence):
         return False
     return True
 
-def call_llm_api(index, llm, messages, api_key):
+def call_llm_api(index, llm, messages, api_key, accept=None):
     logger.debug(f"    Calling {llm} API with messages: {messages}")
-    if llm == "gpt":
-        return call_gpt_api(index, messages, api_key)
-    elif llm == "qwen":
-        return call_qwen_api(index, messages, api_key)
-    elif llm == "glm":
-        return call_glm_api(index, messages, api_key)
-    else:
+    provider = get_provider(llm, api_key)
+    if provider is None:
         logger.error(f"Sentence {index}:\tInvalid llm: {llm}")
         exit(1)
+    # Every request the provider sends, the hedged duplicates of the router included, is admitted against the budget.
+    # Raises BudgetExceeded when the token cap of the job is reached.
+    # accept tells the router whether a reply is good enough to win the race
+    return provider.call(index, messages, budget_scheduler, accept)
   
-def translate_sentence(index, sentence, llm, api_key, user_prompt, window_before_str, window_after_str):
+def get_backoff_delay(num_retries, retry_after=None):
+    # Exponential backoff with full jitter, but never shorter than the wait asked by the provider
+    delay = random.uniform(0, min(subator_constants.TRANSLATE_BACKOFF_CAP, subator_constants.TRANSLATE_BACKOFF_BASE * 2 ** num_retries))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def get_example_messages(examples):
+    # The similar sentences translated before, given as earlier turns of the conversation
+    messages = []
+    for sentence, sentence_translated in examples:
+        messages.append({"role": "user", "content": f"Please translate the following English sentence fragment into Simplified Chinese: {sentence.strip()}."})
+        messages.append({"role": "assistant", "content": sentence_translated})
+    return messages
+
+def translate_sentence(index, sentence, llm, api_key, user_prompt, window_before_str, window_after_str, examples=(), call_llm=call_llm_api):
     RETRY_LIMIT = subator_constants.TRANSLATE_RETRY_LIMIT
     token_used = 0
 
     system_content = f'You are a translation expert and bilingual subtitle production specialist, {user_prompt}. Please use simple sentences as much as possible.'
     user_content = f'This is the preceding text: {window_before_str}. This is the succeeding text: {window_after_str}. Please translate the following English sentence fragment into Simplified Chinese: {sentence}. Do not output any other sentences besides the translation of the fragment.'
-    message = [{"role": "system", "content": system_content}, {"role": "user", "content": user_content}]
+    message = [{"role": "system", "content": system_content}] + get_example_messages(examples) + [{"role": "user", "content": user_content}]
     logger.info(f"Sentence {index}:\t{sentence}")
     sentence_translated = '句子未翻译。'
+    accept = lambda content: content is not None and is_good_response(index, content, sentence)
 
-    sentence_translated, token_usage, response_valid = call_llm_api(index, llm, message, api_key)
+    sentence_translated, token_usage, response_valid, retry_after = call_llm(index, llm, message, api_key, accept)
     token_used += token_usage
     num_retries = 0
 
     user_content = f"Please translate the following English sentence fragment into Chinese: {sentence}. Do not output any other sentences besides the translation of the fragment."
-    message = [{"role": "system", "content": system_content}, {"role": "user", "content": user_content}]
+    message = [{"role": "system", "content": system_content}] + get_example_messages(examples) + [{"role": "user", "content": user_content}]
     while sentence_translated == None or not response_valid or not is_good_response(index, sentence_translated, sentence):
         if num_retries >= RETRY_LIMIT:
             logger.warning(f"\tSentence {index}:\tRetry limit reached.")
             break
-        logger.debug(f"\tSentence {index}:\tRetrying...")
-        sentence_translated, token_usage, response_valid = call_llm_api(index, llm, message, api_key)
+        delay = get_backoff_delay(num_retries, retry_after)
+        logger.debug(f"\tSentence {index}:\tRetrying in {delay:.2f} seconds...")
+        time.sleep(delay)
+        sentence_translated, token_usage, response_valid, retry_after = call_llm(index, llm, message, api_key, accept)
         token_used += token_usage
         num_retries += 1
 
     sentence_translated = sentence_translated.replace("您", "你")
-    return index, sentence_translated, token_used
+    return index, sentence_translated, token_used, num_retries + 1
+
+def parse_batch_response(content, num_sentences):
+    # The reply is expected to contain one line per sentence, each line starts with the number of the sentence
+    numbered_pattern = re.compile(r'^\s*(\d+)\s*[.．、:：)）]\s*(.*)$')
+    parsed = {}
+    if content is None:
+        return parsed
+    for line in content.splitlines():
+        match = numbered_pattern.match(line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        if number < 1 or number > num_sentences or number in parsed:
+            continue
+        parsed[number] = match.group(2).strip()
+    return parsed
+
+def is_good_batch_response(indices, sentences, content):
+    parsed = parse_batch_response(content, len(indices))
+    return len(parsed) == len(indices) and all([is_good_response(index, parsed[i+1], sentences[index]) for i, index in enumerate(indices)])
+
+def translate_batch(indices, sentences, llm, api_key, user_prompt, window_before_str, window_after_str, examples=(), call_llm=call_llm_api):
+    WINDOW_SIZE = subator_constants.TRANSLATE_WINDOW_SIZE
+
+    system_content = f'You are a translation expert and bilingual subtitle production specialist, {user_prompt}. Please use simple sentences as much as possible.'
+    numbered_sentences = '\n'.join([f'{i+1}. {sentences[index].strip()}' for i, index in enumerate(indices)])
+    user_content = f'This is the preceding text: {window_before_str}. This is the succeeding text: {window_after_str}. Please translate each of the following numbered English sentence fragments into Simplified Chinese:\n{numbered_sentences}\nReply with exactly {len(indices)} lines. Each line starts with the number of the fragment followed by its translation. Do not output any other sentences besides the translations of the fragments.'
+    message = [{"role": "system", "content": system_content}] + get_example_messages(examples) + [{"role": "user", "content": user_content}]
+    logger.info(f"Batch {indices[0]}-{indices[-1]}:\t{len(indices)} sentences")
+
+    accept = lambda content: is_good_batch_response(indices, sentences, content)
+    content_translated, token_used, response_valid, retry_after = call_llm(indices[0], llm, message, api_key, accept)
+    parsed = parse_batch_response(content_translated, len(indices)) if response_valid else {}
+
+    # The tokens and the request of the batch are shared by the sentences in the batch
+    token_share = token_used / len(indices)
+    request_share = 1 / len(indices)
+    results = []
+    for i, index in enumerate(indices):
+        sentence_translated = parsed.get(i+1)
+        if sentence_translated is not None and is_good_response(index, sentence_translated, sentences[index]):
+            results.append((index, sentence_translated.replace("您", "你"), token_share, request_share))
+            continue
+        # Fall back to translating the sentence on its own
+        logger.debug(f"\tSentence {index}:\tMissing or bad response in batch, falling back to single sentence translation.")
+        _, sentence_translated, sentence_token_used, num_requests = translate_sentence(
+            index, sentences[index], llm, api_key, user_prompt,
+            ' '.join(sentences[max(0, index-WINDOW_SIZE):index]),
+            ' '.join(sentences[index+1:index+1+WINDOW_SIZE]),
+            examples, call_llm
+        )
+        results.append((index, sentence_translated, token_share + sentence_token_used, request_share + num_requests))
+    return results
+
+def translate_single(index, sentence, llm, api_key, user_prompt, window_before_str, window_after_str, examples=(), call_llm=call_llm_api):
+    return [translate_sentence(index, sentence, llm, api_key, user_prompt, window_before_str, window_after_str, examples, call_llm)]
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values)*q))]
+
+# Concurrency window adjusted by AIMD: grow by one request per round trip on success,
+# halve it on rate limiting or timeout, and stop admitting requests until Retry-After has passed
+class AIMDLimiter:
+    def __init__(self, initial_window, min_window, max_window):
+        self.window = float(initial_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.in_flight = 0
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.condition = asyncio.Condition()
+        self.latencies = []
+        self.num_throttled = 0
+
+    async def acquire(self):
+        while True:
+            async with self.condition:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0:
+                    if self.in_flight < int(self.window):
+                        self.in_flight += 1
+                        return
+                    await self.condition.wait()
+                    continue
+            await asyncio.sleep(wait)
+
+    async def release(self, latency, retry_after):
+        async with self.condition:
+            self.in_flight -= 1
+            self.latencies.append(latency)
+            now = time.monotonic()
+            if retry_after is None:
+                self.window = min(self.max_window, self.window + 1/self.window)
+            else:
+                self.num_throttled += 1
+                # Requests in flight fail together, only shrink once per round trip
+                if now - self.last_decrease > latency:
+                    self.window = max(self.min_window, self.window/2)
+                    self.last_decrease = now
+                    logger.info(f"\tRate limited, concurrency window shrinks to {int(self.window)}")
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self.condition.notify_all()
+
+    async def call(self, executor, call_llm, *args):
+        await self.acquire()
+        start = time.monotonic()
+        retry_after = None
+        try:
+            content_translated, token_used, response_valid, retry_after = await asyncio.get_running_loop().run_in_executor(executor, call_llm, *args)
+        finally:
+            await self.release(time.monotonic() - start, retry_after)
+        # The limiter has already waited for the rate limit, the caller can retry immediately
+        return content_translated, token_used, response_valid, None
+
+async def translate_jobs_async(jobs, handle_results):
+    MAX_CONCURRENCY = subator_constants.TRANSLATE_MAX_CONCURRENCY
+    loop = asyncio.get_running_loop()
+    limiter = AIMDLimiter(subator_constants.TRANSLATE_INITIAL_CONCURRENCY, 1, MAX_CONCURRENCY)
+    start_time = time.monotonic()
+
+    # The SDKs of the providers are blocking, the requests run in one pool and the retry loops of the sentences in another,
+    # the number of requests in flight is decided by the limiter
+    # max_workers must be less than or equal to 61 due to the limitation of windows
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as request_executor, ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as job_executor:
+        def call_llm(index, llm, messages, api_key, accept=None):
+            return asyncio.run_coroutine_threadsafe(limiter.call(request_executor, call_llm_api, index, llm, messages, api_key, accept), loop).result()
+
+        async def run_job(indices, func, args):
+            try:
+                results = await loop.run_in_executor(job_executor, func, *args, call_llm)
+            except Exception as e:
+                results = e
+            handle_results(indices, results)
+
+        await asyncio.gather(*[run_job(indices, func, args) for indices, func, args in jobs])
+
+    elapsed = time.monotonic() - start_time
+    num_requests = len(limiter.latencies)
+    logger.info(f"Requests: {num_requests}, rate limited: {limiter.num_throttled}, final concurrency window: {int(limiter.window)}")
+    if elapsed > 0:
+        logger.info(f"Requests per second: {num_requests/elapsed:.2f}")
+    logger.info(f"Latency p50: {percentile(limiter.latencies, 0.5):.2f} seconds, p95: {percentile(limiter.latencies, 0.95):.2f} seconds")
+
+def translate_jobs_threaded(jobs, handle_results):
+    # max_workers must be less than or equal to 61 due to the limitation of windows
+    with ThreadPoolExecutor(max_workers=61) as executor:
+        future_to_indices = {executor.submit(func, *args): indices for indices, func, args in jobs}
+        for future in as_completed(future_to_indices):
+            try:
+                results = future.result()
+            except Exception as e:
+                results = e
+            handle_results(future_to_indices[future], results)
 
-def translate_all(sentences, llm, api_key, user_prompt):
+def translate_all(sentences, llm, api_key, user_prompt, batch_size=None, cache=None, no_cache_lines=(), engine=None, only_indices=None, memory=None):
     WINDOW_SIZE = subator_constants.TRANSLATE_WINDOW_SIZE
+    if batch_size is None:
+        batch_size = subator_constants.TRANSLATE_BATCH_SIZE
+    if engine is None:
+        engine = subator_constants.TRANSLATE_ENGINE
     tot_tokens = 0
+    tot_requests = 0
     # window_before = []
     # window_before_str = ''
     # window_after = []
@@ -233,55 +328,175 @@ def translate_all(sentences, llm, api_key, user_prompt):
 
     # Start a timer to measure the time taken
     start_time = time.time()
-    # Use ThreadPoolExecutor to translate the sentences in parallel
     sentences_translated = [None] * len(sentences)
-    # max_workers must be less than or equal to 61 due to the limitation of windows
-    with ThreadPoolExecutor(max_workers=61) as executor:
-        future_to_index = {
-            executor.submit(
-                translate_sentence, 
-                i, sentence, llm, api_key, user_prompt, 
-                ' '.join(sentences[max(0, i-WINDOW_SIZE):i]), 
-                ' '.join(sentences[i+1:i+1+WINDOW_SIZE])
-            ): i for i, sentence in enumerate(sentences)
-        }
-        for future in as_completed(future_to_index):
-            index = future_to_index[future]
+
+    # Identical requests in this run are only sent once, with or without the cache. Then the cache is looked up.
+    cache_keys = [None] * len(sentences)
+    duplicate_keys = [None] * len(sentences)
+    duplicates = {}
+    pending = []
+    model = get_provider(llm, api_key).model
+    for i in (range(len(sentences)) if only_indices is None else only_indices):
+        sentence = sentences[i]
+        window_before_str = ' '.join(sentences[max(0, i-WINDOW_SIZE):i])
+        window_after_str = ' '.join(sentences[i+1:i+1+WINDOW_SIZE])
+        key = TranslationCache.make_key(sentence, window_before_str, window_after_str, user_prompt, llm, model)
+        # A line bypassing the cache is only collapsed with the other lines bypassing it, it never gets a cached translation
+        bypass = cache is None or i in no_cache_lines
+        duplicate_keys[i] = (key, bypass)
+        if duplicate_keys[i] in duplicates:
+            duplicates[duplicate_keys[i]].append(i)
+            continue
+        duplicates[duplicate_keys[i]] = []
+        if bypass:
+            pending.append(i)
+            continue
+        cache_keys[i] = key
+        sentence_translated = cache.get(key)
+        if sentence_translated is not None:
+            logger.info(f"\tSentence {i}:\tOriginal: {sentence}")
+            logger.info(f"\tSentence {i}:\tTranslated (cached): {sentence_translated}")
+            sentences_translated[i] = sentence_translated
+        else:
+            pending.append(i)
+    if cache is not None:
+        logger.info(f"Cache hits: {cache.hits}, misses: {cache.misses}, bypassed: {len([i for i in no_cache_lines if i < len(sentences)])}")
+
+    # Reuse the translation of the same sentence from the translation memory, otherwise give the similar ones as examples
+    matches = {}
+    if memory is not None:
+        not_reused = []
+        for i in pending:
+            matches[i] = memory.lookup(sentences[i])
+            if matches[i] and matches[i][0][0] >= subator_constants.TRANSLATION_MEMORY_REUSE_SIMILARITY:
+                logger.info(f"\tSentence {i}:\tOriginal: {sentences[i]}")
+                logger.info(f"\tSentence {i}:\tTranslated (memory): {matches[i][0][2]}")
+                sentences_translated[i] = matches[i][0][2]
+            else:
+                not_reused.append(i)
+        logger.info(f"Translation memory: {len(memory)} pairs, reused: {len(pending) - len(not_reused)}, with examples: {len([i for i in not_reused if matches[i]])}")
+        pending = not_reused
+
+    def get_examples(indices):
+        # The most similar pairs of the sentences, without repeating a pair
+        examples = {}
+        for similarity, sentence, sentence_translated in sorted([match for i in indices for match in matches.get(i, [])], reverse=True):
+            examples.setdefault(sentence, sentence_translated)
+        return list(examples.items())[:subator_constants.TRANSLATION_MEMORY_NUM_EXAMPLES]
+
+    # Each job translates one sentence, or a block of sentences sharing the context in one request
+    jobs = []
+    if batch_size > 1:
+        for start in range(0, len(pending), batch_size):
+            indices = pending[start:start+batch_size]
+            jobs.append((indices, translate_batch, (
+                indices, sentences, llm, api_key, user_prompt,
+                ' '.join(sentences[max(0, indices[0]-WINDOW_SIZE):indices[0]]),
+                ' '.join(sentences[indices[-1]+1:indices[-1]+1+WINDOW_SIZE]),
+                get_examples(indices)
+            )))
+    else:
+        for i in pending:
+            jobs.append(([i], translate_single, (
+                i, sentences[i], llm, api_key, user_prompt,
+                ' '.join(sentences[max(0, i-WINDOW_SIZE):i]),
+                ' '.join(sentences[i+1:i+1+WINDOW_SIZE]),
+                get_examples([i])
+            )))
+
+    def handle_results(indices, results):
+        nonlocal tot_tokens, tot_requests
+        if isinstance(results, BudgetExceeded):
+            logger.info(f"\tSentences {indices[0]}-{indices[-1]}:\tNot translated, {results}")
+            for index in indices:
+                sentences_translated[index] = '句子未翻译。'
+            return
+        if isinstance(results, Exception):
+            logger.error(f"\tSentences {indices[0]}-{indices[-1]}:\tError in translation: {results}")
+            for index in indices:
+                sentences_translated[index] = '句子未翻译。'
+            return
+        for i, sentence_translated, token_used, num_requests in results:
             try:
-                i, sentence_translated, token_used = future.result()
-                t2s = OpenCC('t2s')
                 sentence_translated = t2s.convert(sentence_translated)
-                if not is_good_response(index, sentence_translated, sentences[index]):
+                if not is_good_response(i, sentence_translated, sentences[i]):
                     logger.info(f"\tSentence {i}:\tBad response, Please check the response. Then modify potentially erroneous lines in ch.txt.")
-                logger.info(f"\tSentence {i}:\tOriginal: {sentences[index]}")
+                else:
+                    if cache_keys[i] is not None:
+                        cache.put(cache_keys[i], sentence_translated.strip())
+                    if memory is not None:
+                        memory.add(sentences[i], sentence_translated)
+                logger.info(f"\tSentence {i}:\tOriginal: {sentences[i]}")
                 logger.info(f"\tSentence {i}:\tTranslated: {sentence_translated}")
+                logger.info(f"\tSentence {i}:\tRequests: {num_requests:.2f}, Tokens: {token_used:.0f}")
                 tot_tokens += token_used
+                tot_requests += num_requests
                 sentences_translated[i] = sentence_translated
             except Exception as e:
                 logger.error(f"\tSentence {i}:\tError in translation: {e}")
-                sentences_translated[index] = '句子未翻译。'
+                sentences_translated[i] = '句子未翻译。'
+
+    if engine == 'async':
+        asyncio.run(translate_jobs_async(jobs, handle_results))
+    elif engine == 'thread':
+        translate_jobs_threaded(jobs, handle_results)
+    else:
+        logger.error(f"Invalid translate engine: {engine}")
+        exit(1)
 
-    sentences_translated = [i.strip() for i in sentences_translated]
+    # Fill the repeated sentences with the translation of their first occurrence
+    for i, key in enumerate(duplicate_keys):
+        if key is not None and duplicates.get(key):
+            for j in duplicates.pop(key):
+                logger.info(f"\tSentence {j}:\tSame as sentence {i}")
+                sentences_translated[j] = sentences_translated[i]
+
+    # The sentences not in only_indices stay None
+    sentences_translated = [i.strip() if i is not None else None for i in sentences_translated]
+    get_provider(llm, api_key).log_stats()
+    tot_tokens = round(tot_tokens)
+    tot_requests = round(tot_requests)
     end_time = time.time()
-    logger.info(f"Time taken: {end_time - start_time:.2f} seconds for {len(sentences)} sentences")
+    num_sentences = len(sentences) if only_indices is None else len(only_indices)
+    logger.info(f"Time taken: {end_time - start_time:.2f} seconds for {num_sentences} sentences")
+    if num_sentences > 0:
+        logger.info(f"Requests made: {tot_requests}, {tot_requests/num_sentences:.2f} per sentence")
+        logger.info(f"Tokens used: {tot_tokens}, {tot_tokens/num_sentences:.1f} per sentence")
     
     return sentences_translated, tot_tokens
         
-def translator(sentences_file_path, output_dir, api_key, user_prompt, llm):
-    sentences = get_sentences(sentences_file_path)
+def get_flagged_indices(sentences, sentences_translated):
+    # The lines that would be reported as "Please check the response." and the placeholders of failed translations
+    flagged = []
+    for i in range(len(sentences)):
+        if 'API出错' in sentences_translated[i] or '句子未翻译' in sentences_translated[i] or not is_good_response(i, sentences_translated[i], sentences[i]):
+            flagged.append(i)
+    return flagged
 
-    if llm == 'gpt':
-        global gpt_client
-        # gpt_client = OpenAI(base_url="https://api.chatgptid.net/v1", api_key=api_key)
-        gpt_client = OpenAI(base_url="https://api.chatanywhere.tech/v1", api_key=api_key)
+def prepare_translation(llm, api_key, output_dir, use_cache, use_memory):
+    # Checks the llm, sets up the budget and opens the cache and the translation memory
+    if get_provider(llm, api_key) is None:
+        logger.error(f"Invalid llm: {llm}")
+        exit(1)
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    sentences_translated, tot_tokens = translate_all(sentences, llm, api_key, user_prompt)
+    global budget_scheduler
+    budget_scheduler = None
+    if subator_constants.TRANSLATE_RPM_LIMIT or subator_constants.TRANSLATE_TPM_LIMIT or subator_constants.TRANSLATE_MAX_TOKENS:
+        budget_scheduler = BudgetScheduler()
 
-    # Write the translated sentences to a file
-    output_file = os.path.join(output_dir, "sentences_translated.txt")
+    cache = None
+    if use_cache and subator_constants.TRANSLATION_CACHE_PATH:
+        cache = TranslationCache(subator_constants.TRANSLATION_CACHE_PATH)
+
+    memory = None
+    if use_memory and subator_constants.TRANSLATION_MEMORY_PATH:
+        memory = TranslationMemory(subator_constants.TRANSLATION_MEMORY_PATH)
+    return cache, memory
+
+def write_translated_sentences(output_file, sentences_translated, tot_tokens):
     with open(output_file, 'w', encoding='utf-8') as f:
         for sentence in sentences_translated:
             f.write(sentence + '\n')
@@ -289,6 +504,98 @@ def translator(sentences_file_path, output_dir, api_key, user_prompt, llm):
     logger.info(f"Total tokens used: {tot_tokens}")
     logger.info('')
 
+def translator(sentences_file_path, output_dir, api_key, user_prompt, llm, batch_size=None, use_cache=True, no_cache_lines=(), engine=None, retranslate_flagged=False, use_memory=True):
+    sentences = get_sentences(sentences_file_path)
+    output_file = os.path.join(output_dir, "sentences_translated.txt")
+    cache, memory = prepare_translation(llm, api_key, output_dir, use_cache, use_memory)
+
+    # Only send the flagged lines of the existing translation back to the LLM
+    only_indices = None
+    if retranslate_flagged:
+        if not os.path.exists(output_file):
+            logger.error(f"File '{output_file}' not found.")
+            exit(1)
+        existing_translated = [sentence.strip() for sentence in get_sentences(output_file)]
+        if len(existing_translated) != len(sentences):
+            logger.error(f"Number of translated sentences ({len(existing_translated)}) is not equal to the number of sentences ({len(sentences)})")
+            exit(1)
+        only_indices = get_flagged_indices(sentences, existing_translated)
+        logger.info(f"Retranslating {len(only_indices)} flagged sentences: {only_indices}")
+
+    sentences_translated, tot_tokens = translate_all(sentences, llm, api_key, user_prompt, batch_size, cache, set(no_cache_lines), engine, only_indices, memory)
+
+    if cache is not None:
+        cache.close()
+    if memory is not None:
+        memory.close()
+
+    if only_indices is not None:
+        for i in range(len(sentences)):
+            if sentences_translated[i] is None:
+                sentences_translated[i] = existing_translated[i]
+
+    # Write the translated sentences to a file
+    write_translated_sentences(output_file, sentences_translated, tot_tokens)
+
+def translator_stream(sentence_queue, output_dir, api_key, user_prompt, llm, batch_size=None, use_cache=True, engine=None, use_memory=True):
+    # Translates the sentences put into sentence_queue by transcriber.transcriber while the transcription is running.
+    # The items are ('sentence', sentence), then ('done', sentences) with the final sentences, or ('error', message).
+    # A sentence is translated once the sentences of its succeeding window have arrived, in rounds of at least
+    # TRANSLATE_STREAM_MIN_SENTENCES sentences.
+    WINDOW_SIZE = subator_constants.TRANSLATE_WINDOW_SIZE
+    MIN_SENTENCES = subator_constants.TRANSLATE_STREAM_MIN_SENTENCES
+    output_file = os.path.join(output_dir, "sentences_translated.txt")
+    cache, memory = prepare_translation(llm, api_key, output_dir, use_cache, use_memory)
+
+    # Same as the lines read by get_sentences
+    sentences = []
+    sentences_translated = []
+    final_sentences = None
+    num_translated = 0
+    tot_tokens = 0
+    while final_sentences is None:
+        items = [sentence_queue.get()]
+        while not sentence_queue.empty():
+            items.append(sentence_queue.get())
+        for kind, value in items:
+            if kind == 'sentence':
+                sentences.append(value + '\n')
+                sentences_translated.append(None)
+            elif kind == 'done':
+                final_sentences = [sentence + '\n' for sentence in value]
+            else:
+                logger.error(f"Transcription failed: {value}")
+                exit(1)
+
+        num_ready = len(sentences) - WINDOW_SIZE if final_sentences is None else len(sentences)
+        if num_ready - num_translated < MIN_SENTENCES and final_sentences is None:
+            continue
+        if num_ready > num_translated:
+            logger.info(f"Translating streamed sentences {num_translated}-{num_ready-1}")
+            round_translated, round_tokens = translate_all(sentences, llm, api_key, user_prompt, batch_size, cache, set(), engine, list(range(num_translated, num_ready)), memory)
+            for i in range(num_translated, num_ready):
+                sentences_translated[i] = round_translated[i]
+            tot_tokens += round_tokens
+            num_translated = num_ready
+
+    # The streamed sentences are normally the final ones, otherwise translate the sentences that changed and their neighbours
+    changed = [i for i in range(len(final_sentences)) if i >= len(sentences) or sentences[i] != final_sentences[i]]
+    sentences_translated = sentences_translated[:len(final_sentences)] + [None] * (len(final_sentences) - len(sentences_translated))
+    if changed:
+        logger.warning(f"{len(changed)} streamed sentences are different from the final sentences, translating them again")
+        retranslate = sorted(set([j for i in changed for j in range(max(0, i-WINDOW_SIZE), min(len(final_sentences), i+WINDOW_SIZE+1))]))
+        round_translated, round_tokens = translate_all(final_sentences, llm, api_key, user_prompt, batch_size, cache, set(), engine, retranslate, memory)
+        for i in retranslate:
+            sentences_translated[i] = round_translated[i]
+        tot_tokens += round_tokens
+
+    if cache is not None:
+        cache.close()
+    if memory is not None:
+        memory.close()
+
+    write_translated_sentences(output_file, sentences_translated, tot_tokens)
+
 if __name__ == "__main__":
     # Parse the command line arguments
     parser = argparse.ArgumentParser(description="Translate the sentences")
@@ -297,6 +604,12 @@ if __name__ == "__main__":
     parser.add_argument("--user_prompt", help="User prompt", required=False, default='')
     parser.add_argument("--api_key", help="API key", required=True)
     parser.add_argument("--llm", help="Language model", required=False, default="qwen")
+    parser.add_argument("--batch_size", help="Number of sentences translated in one request", required=False, type=int, default=None)
+    parser.add_argument("--no_cache", help="Do not use the translation cache", action="store_true")
+    parser.add_argument("--no_memory", help="Do not use the translation memory", action="store_true")
+    parser.add_argument("--no_cache_lines", help="Comma separated sentence indices (as in translator.log) that bypass the translation cache", required=False, default='')
+    parser.add_argument("--engine", help="Translate engine, async or thread", required=False, default=None)
+    parser.add_argument("--retranslate_flagged", help="Only retranslate the flagged lines of the existing sentences_translated.txt", action="store_true")
     args = parser.parse_args()
 
     sentences_file_path = args.sentences_file_path
@@ -305,5 +618,7 @@ if __name__ == "__main__":
     api_key = args.api_key
     llm = args.llm
 
+    no_cache_lines = [int(i) for i in args.no_cache_lines.split(',') if i.strip()]
+
     # Translate the sentences
-    translator(sentences_file_path, output_dir, api_key, user_prompt, llm)
\ No newline at end of file
+    translator(sentences_file_path, output_dir, api_key, user_prompt, llm, args.batch_size, not args.no_cache, no_cache_lines, args.engine, args.retranslate_flagged, not args.no_memory)
\ No newline at end of file